@@ -0,0 +1,2 @@
+"""Offline benchmarks of the bot, using fake wandbox / pastebin servers and a
+fake Discord context"""
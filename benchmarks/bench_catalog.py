@@ -0,0 +1,90 @@
+"""Compares the memory used by the engines catalog of the code module with
+the previous layout, where the engines were the dicts of the wandbox list.
+
+Usage (from the root of the repository):
+    python -m benchmarks.bench_catalog --list list.json
+
+The list is the one of wandbox (https://wandbox.org/api/list.json), a fake
+one is generated if it isn't given. The results (bytes allocated by each
+layout, measured with tracemalloc) are printed as JSON."""
+
+import argparse
+import gc
+import json
+import tracemalloc
+
+from benchmarks.fake_servers import create_engines_list
+from modules.utils import engines
+
+
+def build_dicts_catalog(wandbox_list: list):
+    """Previous layout: the dicts of the list, without their redundant
+    keys"""
+    catalog = {}
+    for info in wandbox_list:
+        language = info["language"]
+        template = info["templates"][0]
+        if language == "CPP" or language == "OpenSSL":
+            continue
+        if language == "Bash script":
+            language = "Bash"
+        elif language == "Vim script":
+            language = "Vim"
+        catalog.setdefault(language, {}).setdefault(template,
+                                                    {})[info["name"]] = info
+        for key in ("name", "display-name", "language", "templates",
+                    "provider", "switches"):
+            del info[key]
+    return catalog
+
+
+def measure(build, list_text: str):
+    """Returns the number of bytes retained by a catalog built from the
+    list"""
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    wandbox_list = json.loads(list_text)
+    catalog = build(wandbox_list)
+    del wandbox_list
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    del catalog
+    return size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--list", help="wandbox list.json file")
+    parser.add_argument("--engines-per-language", type=int, default=20,
+                        help="number of engines of the fake list")
+    parser.add_argument("--output", help="file to write the results to")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        with open(args.list, encoding="utf-8") as file:
+            list_text = file.read()
+    else:
+        list_text = json.dumps(create_engines_list(args.engines_per_language))
+    dicts_size = measure(build_dicts_catalog, list_text)
+    slots_size = measure(engines.build_catalog, list_text)
+
+    report = json.dumps(
+        {
+            "config": vars(args),
+            "engines": len(json.loads(list_text)),
+            "dicts_bytes": dicts_size,
+            "slots_bytes": slots_size,
+            "ratio": slots_size / dicts_size
+        },
+        indent=4)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Benchmarks the code module against fake wandbox / pastebin servers.
+
+Usage (from the root of the repository):
+    python -m benchmarks.bench_code --concurrency 20 --requests 500
+
+The results (throughput and latencies in seconds) are printed as JSON."""
+
+import aiohttp
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from benchmarks.fake_discord import FakeBot, FakeContext
+from benchmarks.fake_servers import FakeUpstream
+from benchmarks.workspace import Workspace
+
+CPP_CODE = """```cpp
+#include <iostream>
+
+int main()
+{
+    std::cout << "Hello world!\\n";
+    return 0;
+}```"""
+
+
+def percentile(values: list, percent: float):
+    """Returns the nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    index = max(0, int(round(percent / 100 * len(values))) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def summarize(latencies: list, errors: int, duration: float):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "duration": duration,
+        "throughput": (len(latencies) / duration) if duration else None,
+        "mean": (sum(latencies) / len(latencies)) if latencies else None,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "max": latencies[-1] if latencies else None
+    }
+
+
+async def run_scenario(scenario, nb_requests: int, concurrency: int):
+    """Calls `scenario` nb_requests times, at most `concurrency` at the same
+    time, returns its statistics"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = []
+
+    async def call(i: int):
+        async with semaphore:
+            begin = time.perf_counter()
+            try:
+                await scenario(i)
+            except Exception as e:
+                errors.append(repr(e))
+            else:
+                latencies.append(time.perf_counter() - begin)
+
+    begin = time.perf_counter()
+    await asyncio.gather(*[call(i) for i in range(nb_requests)])
+    stats = summarize(latencies, len(errors), time.perf_counter() - begin)
+    stats["errors_samples"] = errors[:5]
+    return stats
+
+
+def create_scenarios(bot, cog, upstream: FakeUpstream):
+    """Returns the scenarios by name"""
+    paste_url = upstream.add_paste("main", "print(input())", "Python")
+    languages = sorted(cog.configuration)
+
+    async def invoke(command, content: str, **kwargs):
+        # The commands aren't bound to the cog as it isn't added to a bot
+        await command.callback(cog, FakeContext(bot, content), **kwargs)
+
+    async def code(i: int):
+        await invoke(cog.code, ">code " + CPP_CODE, code=CPP_CODE)
+
+    async def code_paste(i: int):
+        text = "code `" + paste_url + "`\ninput `" + str(i) + "`"
+        await invoke(cog.code, ">code " + text, code=text)
+
+    async def code_tests(i: int):
+        text = CPP_CODE + "\ntests `1\n---\n1\n===\n2\n---\n2`"
+        await invoke(cog.code, ">code " + text, code=text)
+
+    async def embed(i: int):
+        ctx = FakeContext(bot, ">code " + CPP_CODE)
+        await cog.create_embed_result(
+            ctx, "C++", "gcc", "gcc-head", "", {
+                "status": "0",
+                "program_output": "Hello world!\n" * (i % 30)
+            })
+
+    async def list_languages(i: int):
+        await invoke(cog.list_languages, ">list_languages")
+
+    async def list_engines(i: int):
+        language = languages[i % len(languages)]
+        await invoke(cog.list_engines,
+                     ">list_engines " + language,
+                     language_name=language)
+
+    return {
+        "code": code,
+        "code_paste": code_paste,
+        "code_tests": code_tests,
+        "embed": embed,
+        "list_languages": list_languages,
+        "list_engines": list_engines
+    }
+
+
+async def run_benchmarks(args, upstream: FakeUpstream):
+    from modules.code import Code
+
+    loop = asyncio.get_event_loop()
+    async with aiohttp.ClientSession() as session:
+        bot = FakeBot(loop, session)
+        cog = Code(bot)
+        await cog.info_loader
+        scenarios = create_scenarios(bot, cog, upstream)
+        results = {}
+        for name in args.scenarios or scenarios:
+            results[name] = await run_scenario(scenarios[name], args.requests,
+                                               args.concurrency)
+        return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--requests", type=int, default=200,
+                        help="number of calls per scenario")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="mean latency of the fake servers (seconds)")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--engines-per-language", type=int, default=10)
+    parser.add_argument("--scenarios", nargs="*",
+                        help="scenarios to run (all by default)")
+    parser.add_argument("--output", help="file to write the results to")
+    args = parser.parse_args(argv)
+
+    upstream = FakeUpstream(args.latency, args.jitter, args.failure_rate,
+                            args.engines_per_language)
+    with Workspace(upstream):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        results = loop.run_until_complete(run_benchmarks(args, upstream))
+        loop.close()
+
+    report = json.dumps(
+        {
+            "config": vars(args),
+            "upstream_requests": upstream.requests_count,
+            "scenarios": results
+        },
+        indent=4)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""Benchmarks the dispatch of the incoming messages by the bot.
+
+Messages are passed to Discode.on_message as if they were received from the
+gateway, without connecting to Discord. Most messages of big servers aren't
+commands, they should be rejected as cheaply as possible.
+
+Usage (from the root of the repository):
+    python -m benchmarks.bench_dispatch --messages 100000
+
+The results (mean time per message in microseconds, by kind of message) are
+printed as JSON."""
+
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.fake_discord import FakeChannel, FakeMessage, FakeUser
+from benchmarks.fake_servers import FakeUpstream
+from benchmarks.replay import create_bot
+from benchmarks.workspace import Workspace
+
+
+def create_messages(bot, channel: FakeChannel):
+    """Returns a message of each kind, by kind"""
+    author = FakeUser()
+    blacklisted = FakeUser()
+    bot.blacklist.add(blacklisted.id)
+    return {
+        "chat":
+            FakeMessage(channel, author,
+                        "Has anyone tried the new version of the library?"),
+        "mention":
+            FakeMessage(channel, author,
+                        "<@" + str(bot.user.id) + "> what can you do?"),
+        "blacklisted":
+            FakeMessage(channel, blacklisted, bot.prefix + "list_languages"),
+        "unknown_command":
+            FakeMessage(channel, author, bot.prefix + "not_a_command")
+    }
+
+
+async def run_benchmarks(args):
+    loop = asyncio.get_event_loop()
+    bot = create_bot(loop)
+    channel = FakeChannel(bot.user)
+    results = {}
+    try:
+        for kind, message in create_messages(bot, channel).items():
+            begin = time.perf_counter()
+            for _ in range(args.messages):
+                await bot.on_message(message)
+            duration = time.perf_counter() - begin
+            results[kind] = {
+                "messages": args.messages,
+                "mean_us": duration / args.messages * 1e6
+            }
+    finally:
+        await bot.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--messages", type=int, default=100000,
+                        help="number of messages of each kind")
+    parser.add_argument("--output", help="file to write the results to")
+    args = parser.parse_args(argv)
+
+    with Workspace(FakeUpstream()):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        results = loop.run_until_complete(run_benchmarks(args))
+        loop.close()
+
+    report = json.dumps({"config": vars(args), "messages": results}, indent=4)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Fake Discord objects, recording what the bot sends"""
+
+import asyncio
+from datetime import datetime
+import itertools
+import time
+
+from modules.utils import metrics
+
+# Snowflake-like IDs
+_ids = itertools.count(100000000000000000)
+
+
+class FakeUser:
+    """Fake Discord user"""
+
+    def __init__(self, name: str = "user", user_id: int = None):
+        self.id = user_id or next(_ids)
+        self.name = name
+        self.discriminator = "0000"
+        self.avatar_url = "https://cdn.discordapp.com/embed/avatars/0.png"
+        self.bot = False
+
+    def __str__(self):
+        return self.name + "#" + self.discriminator
+
+
+class FakeMessage:
+    """Fake Discord message"""
+
+    def __init__(self, channel, author: FakeUser, content: str = None,
+                 embed=None, file=None):
+        self.id = next(_ids)
+        self.channel = channel
+        self.author = author
+        self.content = content
+        self.embeds = [embed] if embed else []
+        self.file = file
+        self.guild = None
+        self._state = getattr(channel, "_state", None)
+        self.mentions = []
+        self.role_mentions = []
+        self.channel_mentions = []
+        self.created_at = datetime.utcnow()
+        self.edits = 0
+
+    async def edit(self, content=None, embed=None):
+        self.content = content
+        self.embeds = [embed] if embed else []
+        self.edits += 1
+
+    async def add_reaction(self, emoji):
+        pass
+
+
+class FakeTyping:
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FakeHTTPClient:
+
+    async def send_typing(self, channel_id: int):
+        pass
+
+
+class FakeConnectionState:
+
+    def __init__(self):
+        self.http = FakeHTTPClient()
+
+    @property
+    def loop(self):
+        return asyncio.get_event_loop()
+
+
+class FakeChannel:
+    """Fake Discord channel, records the messages sent with their sending
+    time (time.perf_counter())"""
+
+    def __init__(self, bot_user: FakeUser, channel_id: int = None):
+        self.id = channel_id or next(_ids)
+        self.bot_user = bot_user
+        self.guild = None
+        self.sent = []
+        # Used by discord.py for the typing indicator
+        self._state = FakeConnectionState()
+        self._responded = None
+
+    @property
+    def responded(self):
+        """Event set once a message has been sent in the channel"""
+        if not self._responded:
+            self._responded = asyncio.Event()
+            if self.sent:
+                self._responded.set()
+        return self._responded
+
+    async def _get_channel(self):
+        return self
+
+    async def send(self, content=None, *, embed=None, file=None, **kwargs):
+        message = FakeMessage(self, self.bot_user, content, embed, file)
+        self.sent.append((time.perf_counter(), message))
+        if self._responded:
+            self._responded.set()
+        return message
+
+    def typing(self):
+        return FakeTyping()
+
+
+class FakeContext:
+    """Fake commands.Context, for calling the commands directly"""
+
+    def __init__(self, bot, content: str, author: FakeUser = None,
+                 channel: FakeChannel = None):
+        self.bot = bot
+        self.channel = channel or FakeChannel(bot.user)
+        self.message = FakeMessage(self.channel, author or FakeUser(),
+                                   content)
+        self.invoked_subcommand = None
+        self.prefix = bot.prefix
+
+    async def send(self, content=None, embed=None, file=None):
+        return await self.channel.send(content, embed=embed, file=file)
+
+    def typing(self):
+        return self.channel.typing()
+
+
+class FakeBot:
+    """Fake bot, with the attributes used by the modules"""
+
+    def __init__(self, loop, session):
+        self.loop = loop
+        self.session = session
+        self.user = FakeUser("Discode")
+        self.user.bot = True
+        self.prefix = ">"
+        self.owner_id = None
+        self.config_owner_id = -1
+        self.metrics = metrics.MetricsRegistry()
+        self.cogs_states = {}
+
+    async def wait_until_ready(self):
+        pass
+
+    def get_channel(self, channel_id: int):
+        return None
@@ -0,0 +1,167 @@
+"""Fake wandbox and pastebin servers"""
+
+import asyncio
+from aiohttp import web
+import json
+import random
+import threading
+
+from modules.utils import utils
+
+# Wandbox names of the languages which are renamed by the bot
+WANDBOX_LANGUAGES_NAMES = {"Bash": "Bash script", "Vim": "Vim script"}
+
+
+def create_engines_list(engines_per_language: int = 10):
+    """Creates a list.json similar to wandbox's one, based on the default
+    engines of the bot"""
+    default_engines = utils.load_json("data/code/default_engines.json")
+    extensions = utils.load_json("data/code/languages_files_extensions.json")
+    engines = []
+    for language, (template, default_engine) in default_engines.items():
+        names = [default_engine] + [
+            default_engine + "-" + str(i) + ".0.0"
+            for i in range(1, engines_per_language)
+        ]
+        extension = extensions[language][0]
+        for name in names:
+            engines.append({
+                "name": name,
+                "display-name": name,
+                "language": WANDBOX_LANGUAGES_NAMES.get(language, language),
+                "templates": [template],
+                "provider": 0,
+                "switches": [],
+                "version": "1.0.0",
+                "display-compile-command": name + " prog." + extension,
+                "compiler-option-raw": True,
+                "runtime-option-raw": False
+            })
+    return engines
+
+
+class FakeUpstream:
+    """Fake wandbox (under /api/) and pastebin servers, run in their own
+    thread.
+
+    latency: Mean latency of the responses, in seconds
+    jitter: Maximum random variation of the latency, in seconds
+    failure_rate: Probability for a request to fail (HTTP 500)"""
+
+    def __init__(self,
+                 latency: float = 0.0,
+                 jitter: float = 0.0,
+                 failure_rate: float = 0.0,
+                 engines_per_language: int = 10):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.engines = create_engines_list(engines_per_language)
+        # Pastes (code, language) by ID
+        self.pastes = {}
+        self.requests_count = {}
+        self.port = None
+        self.loop = None
+        self.runner = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:" + str(self.port) + "/"
+
+    @property
+    def wandbox_url(self):
+        return self.url + "api/"
+
+    def add_paste(self, paste_id: str, code: str, language: str = None):
+        """Adds a paste, returns its url"""
+        self.pastes[paste_id] = (code, language)
+        return self.url + paste_id
+
+    async def simulate_network(self, request: web.Request):
+        """Waits for the latency, raises an HTTP error according to the
+        failure rate"""
+        self.requests_count[request.path] = \
+            self.requests_count.get(request.path, 0) + 1
+        latency = self.latency + random.uniform(-self.jitter, self.jitter)
+        if latency > 0:
+            await asyncio.sleep(latency)
+        if random.random() < self.failure_rate:
+            raise web.HTTPInternalServerError(text="Fake failure")
+
+    async def list_engines(self, request: web.Request):
+        await self.simulate_network(request)
+        return web.json_response(self.engines)
+
+    async def compile(self, request: web.Request):
+        await self.simulate_network(request)
+        data = json.loads(await request.text())
+        result = {
+            "status": "0",
+            "program_message": data["stdin"] or "Hello world!\n",
+            "program_output": data["stdin"] or "Hello world!\n"
+        }
+        if data.get("save"):
+            result["url"] = self.url + "permlink/" + \
+                str(random.getrandbits(32))
+        return web.json_response(result)
+
+    async def create_paste(self, request: web.Request):
+        await self.simulate_network(request)
+        data = await request.post()
+        paste_id = "p" + str(len(self.pastes))
+        self.pastes[paste_id] = (data["api_paste_code"], None)
+        return web.Response(text=self.url + paste_id)
+
+    async def get_paste(self, request: web.Request):
+        await self.simulate_network(request)
+        paste_id = request.match_info["paste_id"]
+        if paste_id not in self.pastes:
+            raise web.HTTPNotFound()
+        language = self.pastes[paste_id][1] or "None"
+        # Mimics the part of pastebin pages read by the bot
+        return web.Response(text="<html><a href=\"/archive/" +
+                            language.lower() + "\" style=\"margin:0\">" +
+                            language + "</a></html>",
+                            content_type="text/html")
+
+    async def get_raw_paste(self, request: web.Request):
+        await self.simulate_network(request)
+        paste_id = request.match_info["paste_id"]
+        if paste_id not in self.pastes:
+            raise web.HTTPNotFound()
+        return web.Response(text=self.pastes[paste_id][0])
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_get("/api/list.json", self.list_engines)
+        app.router.add_post("/api/compile.json", self.compile)
+        app.router.add_post("/api/api_post.php", self.create_paste)
+        app.router.add_get("/raw/{paste_id}", self.get_raw_paste)
+        app.router.add_get("/{paste_id}", self.get_paste)
+        return app
+
+    def start(self):
+        """Starts the servers in their own thread"""
+        started = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.runner = web.AppRunner(self.create_app())
+            self.loop.run_until_complete(self.runner.setup())
+            site = web.TCPSite(self.runner, "127.0.0.1", 0)
+            self.loop.run_until_complete(site.start())
+            self.port = site._server.sockets[0].getsockname()[1]
+            started.set()
+            self.loop.run_forever()
+            self.loop.run_until_complete(self.runner.cleanup())
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
@@ -0,0 +1,183 @@
+"""Replays recorded traffic through the bot's command processing.
+
+The traffic is recorded by the bot when the DISCODE_TRAFFIC_FILE environment
+variable is set (see modules/utils/traffic.py). The messages are dispatched
+to the bot as if they were received from the gateway, at their recorded
+timing divided by each speed multiplier. The bot talks to fake wandbox /
+pastebin servers and fake Discord channels.
+
+Usage (from the root of the repository):
+    python -m benchmarks.replay traffic.jsonl --speeds 1 2 4 8 16
+
+For each speed, the report (JSON) gives the offered rate, the sustained
+throughput and the latencies (time to the first answer of the bot, in
+seconds). The saturation speed is the first speed at which the p95 latency
+exceeds the baseline one (first speed) by the degradation factor, or at which
+the throughput can't keep up with the offered rate anymore."""
+
+import argparse
+import asyncio
+from contextlib import redirect_stdout
+import json
+import sys
+import time
+
+from benchmarks.bench_code import summarize
+from benchmarks.fake_discord import FakeChannel, FakeMessage, FakeUser
+from benchmarks.fake_servers import FakeUpstream
+from benchmarks.workspace import Workspace
+
+
+def load_trace(file_path: str):
+    """Loads a recorded traffic file"""
+    trace = []
+    with open(file_path, encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                trace.append(json.loads(line))
+    trace.sort(key=lambda entry: entry["time"])
+    return trace
+
+
+def create_bot(loop):
+    """Creates the bot, without connecting it to Discord"""
+    from bot import Discode
+
+    with redirect_stdout(sys.stderr):
+        bot = Discode(loop)
+        # The bot user is normally set by the gateway, which then marks
+        # the bot as ready (the modules wait for it to load their data)
+        bot._connection.user = FakeUser("Discode")
+        bot._ready.set()
+        bot._connection.user.bot = True
+        bot.update_prefixes()
+        bot.load_modules()
+    return bot
+
+
+async def wait_answer(channel: FakeChannel, dispatched_at: float,
+                      timeout: float):
+    """Returns the time the bot took to answer in a channel, or None"""
+    try:
+        await asyncio.wait_for(channel.responded.wait(), timeout)
+    except asyncio.TimeoutError:
+        return None
+    return channel.sent[0][0] - dispatched_at
+
+
+async def replay(bot, trace: list, speed: float, timeout: float):
+    """Replays a trace at a given speed, returns its statistics"""
+    authors = {}
+    waiters = []
+    begin = time.perf_counter()
+    for entry in trace:
+        delay = entry["time"] / speed - (time.perf_counter() - begin)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if entry["author"] not in authors:
+            authors[entry["author"]] = FakeUser("user", entry["author"])
+        # Each message has its own channel, so that its answer can be
+        # identified
+        channel = FakeChannel(bot.user)
+        if entry["prefix"] == "prefix":
+            content = bot.prefix + entry["content"]
+        else:
+            content = "<@" + str(bot.user.id) + "> " + entry["content"]
+        message = FakeMessage(channel, authors[entry["author"]], content)
+        dispatched_at = time.perf_counter()
+        bot.dispatch("message", message)
+        waiters.append(
+            asyncio.ensure_future(wait_answer(channel, dispatched_at,
+                                              timeout)))
+    answers = await asyncio.gather(*waiters)
+    duration = time.perf_counter() - begin
+
+    latencies = [answer for answer in answers if answer is not None]
+    stats = summarize(latencies, len(answers) - len(latencies), duration)
+    stats["unanswered"] = stats.pop("errors")
+    trace_duration = (trace[-1]["time"] - trace[0]["time"]) / speed
+    stats["offered_rate"] = (len(trace) /
+                             trace_duration) if trace_duration else None
+    return stats
+
+
+async def run_replays(args, trace: list):
+    loop = asyncio.get_event_loop()
+    bot = create_bot(loop)
+    results = {}
+    try:
+        for speed in args.speeds:
+            results[str(speed)] = await replay(bot, trace, speed, args.timeout)
+    finally:
+        await bot.close()
+    return results
+
+
+def find_saturation(results: dict, degradation: float):
+    """Returns the first speed at which the bot can't keep up anymore"""
+    baseline = None
+    for speed, stats in results.items():
+        if stats["p95"] is None:
+            return speed
+        if baseline is None:
+            baseline = stats["p95"]
+        if stats["p95"] > degradation * baseline or (
+                stats["offered_rate"] and stats["throughput"] <
+                0.9 * stats["offered_rate"]) or stats["unanswered"]:
+            return speed
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("trace", help="recorded traffic file")
+    parser.add_argument("--speeds", type=float, nargs="+",
+                        default=[1, 2, 4, 8, 16],
+                        help="speed multipliers of the replays")
+    parser.add_argument("--timeout", type=float, default=30,
+                        help="time after which a message is considered as "
+                        "unanswered (seconds)")
+    parser.add_argument("--degradation", type=float, default=2.0,
+                        help="p95 latency factor considered as saturation")
+    parser.add_argument("--latency", type=float, default=0.5,
+                        help="mean latency of the fake servers (seconds)")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="file to write the report to")
+    args = parser.parse_args(argv)
+
+    trace = load_trace(args.trace)
+    if not trace:
+        print("The trace is empty.", file=sys.stderr)
+        return 1
+    upstream = FakeUpstream(args.latency, args.jitter, args.failure_rate)
+    with Workspace(upstream):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        results = loop.run_until_complete(run_replays(args, trace))
+        loop.close()
+
+    saturation = find_saturation(results, args.degradation)
+    sustained = [
+        stats["throughput"] for speed, stats in results.items()
+        if saturation is None or float(speed) < float(saturation)
+    ]
+    report = json.dumps(
+        {
+            "config": vars(args),
+            "messages": len(trace),
+            "replays": results,
+            "saturation_speed": saturation,
+            "max_sustained_throughput": max(sustained) if sustained else None
+        },
+        indent=4)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(report)
+    else:
+        print(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
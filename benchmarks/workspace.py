@@ -0,0 +1,67 @@
+"""Temporary working directory for the benchmarks"""
+
+import os
+import shutil
+import tempfile
+
+from benchmarks.fake_servers import FakeUpstream
+from modules.utils import utils
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Workspace:
+    """Context manager creating a temporary working directory with the data
+    of the bot and a fake configuration, and starting the fake upstream
+    servers, so that the benchmarks don't touch the bot's files nor the
+    network"""
+
+    def __init__(self, upstream: FakeUpstream, prefix: str = ">"):
+        self.upstream = upstream
+        self.prefix = prefix
+        self.folder = None
+        self.previous_folder = None
+        self.previous_environ = None
+
+    def __enter__(self):
+        self.folder = tempfile.mkdtemp(prefix="discode-bench-")
+        os.makedirs(os.path.join(self.folder, "data", "code"))
+        os.makedirs(os.path.join(self.folder, "settings"))
+        for file_name in os.listdir(os.path.join(ROOT, "data", "code")):
+            if file_name.endswith(".json") and file_name.startswith(
+                    ("default_", "languages_")):
+                shutil.copy(os.path.join(ROOT, "data", "code", file_name),
+                            os.path.join(self.folder, "data", "code"))
+        # The bot checks that its modules exist relatively to its working
+        # directory
+        try:
+            os.symlink(os.path.join(ROOT, "modules"),
+                       os.path.join(self.folder, "modules"))
+        except OSError:
+            shutil.copytree(os.path.join(ROOT, "modules"),
+                            os.path.join(self.folder, "modules"))
+        with open(os.path.join(self.folder, "data", "code",
+                               "pastebin_key.txt"), "w") as file:
+            file.write("fake key")
+        utils.save_json(
+            {
+                "token": "fake token",
+                "prefix": self.prefix,
+                "description": "Benchmarked bot",
+                "owner id": 1
+            }, os.path.join(self.folder, "settings", "config.json"))
+
+        self.previous_folder = os.getcwd()
+        os.chdir(self.folder)
+        self.upstream.start()
+        self.previous_environ = dict(os.environ)
+        os.environ["DISCODE_WANDBOX_URL"] = self.upstream.wandbox_url
+        os.environ["DISCODE_PASTEBIN_URL"] = self.upstream.url
+        return self
+
+    def __exit__(self, *args):
+        os.environ.clear()
+        os.environ.update(self.previous_environ)
+        self.upstream.stop()
+        os.chdir(self.previous_folder)
+        shutil.rmtree(self.folder)
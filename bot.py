@@ -5,36 +5,53 @@ import aiohttp
 from datetime import datetime, timedelta
 import discord
 from discord.ext import commands
-import importlib
+from modules.utils import memory
+from modules.utils import metrics
+from modules.utils import stats
+from modules.utils import tracing
+from modules.utils import traffic
 from modules.utils import utils
+from modules.utils import watchdog
 import os
+import signal
 import sys
+import time
 
 # Useful functions
 if sys.platform == "win32" or sys.platform == "win64":
 
     def clear():
-        return os.system("cls")
+        # Only a terminal is cleared, not an output redirected to a file
+        if sys.__stdout__.isatty():
+            return os.system("cls")
 else:
 
     def clear():
-        return os.system("clear")
+        # Only a terminal is cleared, not an output redirected to a file
+        if sys.__stdout__.isatty():
+            return os.system("clear")
 
 
 def _prefix_callable(bot, msg):
-    return [
-        "<@!" + str(bot.user.id) + "> ", "<@" + str(bot.user.id) + "> ",
-        bot.prefix
-    ]
+    return bot.prefixes
 
 
 class Discode(commands.Bot):
     """The bot class"""
 
     def load_config(self):
-        """Loads self.config_file_path, gets the infos if the file
-        doesn't exists"""
-        if not os.path.exists(self.config_file_path):
+        """Loads self.config_file_path, the DISCODE_TOKEN, DISCODE_PREFIX,
+        DISCODE_DESCRIPTION and DISCODE_OWNER_ID environment variables
+        override its values. Asks for the infos if there are neither, and
+        if the bot runs in a terminal"""
+        if not os.path.exists(self.config_file_path) \
+                and "DISCODE_TOKEN" not in os.environ:
+            if not sys.stdin.isatty():
+                print("The bot isn't configured! Please create \"" +
+                      self.config_file_path + "\" or set the DISCODE_TOKEN, "
+                      "DISCODE_PREFIX and DISCODE_OWNER_ID environment "
+                      "variables.")
+                sys.exit(1)
 
             json_data = {}
             token = input("Please put your bot's token here:\n> ")
@@ -43,41 +60,54 @@ class Discode(commands.Bot):
             description = input("\n\nPlease put a little description "
                                 "for your bot (optionnal)\n> ")
             if description == "":
-                description = ("A bot that runs code.\nIf you have any "
-                               "problem with Discode or if you just want "
-                               "to be in the development server, you can "
-                               "join it using this link: discord.gg/UpYc98d")
+                description = self.default_description
             owner_id = int(input("\n\nPlease put your ID:\n> "))
 
             json_data["token"] = token
             json_data["prefix"] = prefix
             json_data["description"] = description
             json_data["owner id"] = owner_id
-            self.token = token
-            self.prefix = prefix
-            self.description = description
-            self.config_owner_id = owner_id
 
             if not os.path.isdir("settings"):
                 os.makedirs("settings")
 
             utils.save_json(json_data, self.config_file_path)
 
-        else:
+        elif os.path.exists(self.config_file_path):
             json_data = utils.load_json(self.config_file_path)
-            if "token" not in json_data or "prefix" not in json_data \
-                    or "description" not in json_data \
-                    or "owner id" not in json_data:
+        else:
+            json_data = {"description": self.default_description}
+
+        for key, variable in (("token", "DISCODE_TOKEN"),
+                              ("prefix", "DISCODE_PREFIX"),
+                              ("description", "DISCODE_DESCRIPTION"),
+                              ("owner id", "DISCODE_OWNER_ID")):
+            if variable in os.environ:
+                json_data[key] = os.environ[variable]
+        if "token" not in json_data or "prefix" not in json_data \
+                or "description" not in json_data \
+                or "owner id" not in json_data:
+            if os.path.exists(self.config_file_path):
                 print("\"settings/config.json\" is incorrect! "
                       "The bot will be reseted, "
                       "please restart the bot!")
                 os.remove(self.config_file_path)
-                sys.exit(1)
             else:
-                self.token = json_data["token"]
-                self.prefix = json_data["prefix"]
-                self.description = json_data["description"]
-                self.config_owner_id = json_data["owner id"]
+                print("DISCODE_PREFIX and DISCODE_OWNER_ID must be set with "
+                      "DISCODE_TOKEN!")
+            sys.exit(1)
+        elif not str(json_data["owner id"]).strip().isdigit():
+            if "DISCODE_OWNER_ID" in os.environ:
+                print("DISCODE_OWNER_ID must be a Discord user ID!")
+            else:
+                print("The owner id of \"settings/config.json\" must be a "
+                      "Discord user ID!")
+            sys.exit(1)
+        else:
+            self.token = json_data["token"]
+            self.prefix = json_data["prefix"]
+            self.description = json_data["description"]
+            self.config_owner_id = int(json_data["owner id"])
 
     def reset_infos(self):
         """Resets bot's info"""
@@ -112,6 +142,8 @@ class Discode(commands.Bot):
                 self.total_commands = json_data["total commands"]
                 self.total_runtime = timedelta(
                     seconds=json_data["total runtime"])
+        # Number of commands already counted in the info file
+        self.saved_total_commands = self.total_commands
 
     def load_blacklist(self):
         """Loads the blacklist"""
@@ -119,53 +151,111 @@ class Discode(commands.Bot):
             if not os.path.isdir("settings"):
                 os.makedirs("settings")
 
-            utils.save_json(self.blacklist, self.blacklist_file_path)
+            utils.save_json(list(self.blacklist), self.blacklist_file_path)
         else:
-            self.blacklist = utils.load_json(self.blacklist_file_path)
+            self.blacklist = set(utils.load_json(self.blacklist_file_path))
+        self.blacklist_mtime = utils.get_mtime(self.blacklist_file_path)
+
+    async def add_to_blacklist(self, user_id: int):
+        """Adds an user to the blacklist, which may be shared with other
+        processes"""
+
+        def add(blacklist: list):
+            if user_id not in blacklist:
+                blacklist.append(user_id)
+
+        self.blacklist = set(await utils.update_json_async(
+            self.blacklist_file_path, add, []))
+        self.blacklist_mtime = utils.get_mtime(self.blacklist_file_path)
+
+    async def remove_from_blacklist(self, user_id: int):
+        """Removes an user from the blacklist, which may be shared with
+        other processes"""
+
+        def remove(blacklist: list):
+            if user_id in blacklist:
+                blacklist.remove(user_id)
+
+        self.blacklist = set(await utils.update_json_async(
+            self.blacklist_file_path, remove, []))
+        self.blacklist_mtime = utils.get_mtime(self.blacklist_file_path)
+
+    async def watch_shared_files(self, interval: float = 5):
+        """Reloads the files modified by other processes (see the cluster
+        mode of the launcher)"""
+        while True:
+            await asyncio.sleep(interval)
+            mtime = utils.get_mtime(self.blacklist_file_path)
+            if mtime and mtime != self.blacklist_mtime:
+                self.blacklist_mtime = mtime
+                self.blacklist = set(await self.loop.run_in_executor(
+                    None, utils.load_json, self.blacklist_file_path))
 
     def load_modules(self):
-        """Loads the bot modules"""
+        """Loads the bot modules which aren't loaded yet (once, before
+        connecting to Discord), prints how long each one took"""
         if not os.path.exists(self.modules_file_path):
-            json_data = self.default_modules
-            self.modules = self.default_modules
-            utils.save_json(json_data, self.modules_file_path)
+            utils.save_json(self.default_modules, self.modules_file_path)
 
         print("\n\n")
         self.modules = set(utils.load_json(self.modules_file_path))
         to_remove = []
+        begin = time.perf_counter()
         for mod in self.modules:
             module_path = "modules/" + mod + ".py"
-            module_name = module_path.replace('/', '.')[:-3]
             if not os.path.exists(module_path):
                 print("\n\nThe module \"" + mod + "\" doesn't exist!")
                 to_remove.append(mod)
-            else:
+            elif mod not in self.loaded_modules:
+                module_begin = time.perf_counter()
                 try:
-                    if mod not in self.loaded_modules:
-                        print("Loading " + mod + " module...")
-                        module = importlib.import_module(
-                            module_path.replace('/', '.')[:-3])
-                        importlib.reload(module)
-                        super().load_extension(module_name)
-                        self.loaded_modules.append(mod)
-                except SyntaxError as ex:
-                    print("Error in " + mod + " module:\n\n" + str(ex) + "\n\n")
+                    super().load_extension("modules." + mod)
+                    self.loaded_modules.append(mod)
+                    print("Loaded " + mod + " module in " + "{:.1f}".format(
+                        (time.perf_counter() - module_begin) * 1000) + " ms")
+                except commands.ExtensionError as ex:
+                    print("Error in " + mod + " module:\n\n" + str(ex) +
+                          "\n\n")
                     to_remove.append(mod)
         for mod in to_remove:
             self.modules.remove(mod)
         utils.save_json(list(self.modules), self.modules_file_path)
+        print("\n" + str(len(self.loaded_modules)) + " modules loaded in " +
+              "{:.1f}".format((time.perf_counter() - begin) * 1000) + " ms.")
+
+    def get_cache_options(self):
+        """Returns the gateway intents and the cache options of the bot"""
+        intents = discord.Intents.default()
+        if not self.low_memory:
+            return {"intents": intents}
+        intents.members = False
+        intents.presences = False
+        intents.typing = False
+        intents.voice_states = False
+        return {
+            "intents": intents,
+            "member_cache_flags": discord.MemberCacheFlags.none(),
+            "chunk_guilds_at_startup": False,
+            "max_messages": None
+        }
 
     def init_data(self):
         if not os.path.isdir("data"):
             os.makedirs("data")
 
-    def __init__(self, loop):
+    def __init__(self, loop, cluster_id: int = None, **options):
 
-        clear()
+        # The processes of a cluster share the terminal
+        if cluster_id is None:
+            clear()
         self.token = ""
         self.prefix = ""
         self.description = ""
         self.config_owner_id = -1
+        self.default_description = (
+            "A bot that runs code.\nIf you have any problem with Discode or "
+            "if you just want to be in the development server, you can join "
+            "it using this link: discord.gg/UpYc98d")
         self.config_file_path = "settings/config.json"
         self.load_config()
         self.created_at = None
@@ -178,80 +268,255 @@ class Discode(commands.Bot):
         self.loaded_modules = []
         self.modules_file_path = "settings/modules.json"
         self.blacklist_file_path = "settings/blacklist.json"
-        self.blacklist = []
+        # Blacklisted users IDs, saved as a list
+        self.blacklist = set()
         self.load_blacklist()
         self.init_data()
         self.invite_link = ""
         self.modules = []
+        # States of the modules being reloaded, by cog name (see
+        # Code.export_state)
+        self.cogs_states = {}
+        # Tasks executing commands, waited for by drain
+        self.invocations = set()
+        # Set when the bot is shutting down, the new commands are refused
+        self.draining = False
+        self.drain_deadline = float(
+            os.environ.get("DISCODE_DRAIN_TIMEOUT", "30"))
         self.version = "1.1.0"
         self.launched_at = datetime.now()
+        # Opt-in low-memory mode, for big bots: the members, the presences
+        # and the messages aren't cached
+        self.low_memory = os.environ.get("DISCODE_LOW_MEMORY", "0") != "0"
+        options.update(self.get_cache_options())
         super().__init__(command_prefix=_prefix_callable,
                          description=self.description,
-                         loop=loop)
+                         loop=loop,
+                         **options)
+        # ID of the process in cluster mode (see launcher.py), None otherwise
+        self.cluster_id = cluster_id
+        # Last statistics of the other processes of the cluster, by cluster
+        # ID
+        self.cluster_stats = {}
+        # Tasks running as long as the bot, cancelled when it's closed
+        self.background_tasks = [
+            self.loop.create_task(self.watch_shared_files())
+        ]
+        self.update_prefixes()
         self.session = aiohttp.ClientSession(loop=loop)
         self.dev_server_invitation_link = "discord.gg/UpYc98d"
-        clear()
+        self.stats = stats.BotStats()
+        self.stats.add_listeners(self)
+        # Opt-in recording of the commands, see benchmarks/replay.py
+        self.traffic_recorder = None
+        if os.environ.get("DISCODE_TRAFFIC_FILE"):
+            self.traffic_recorder = traffic.TrafficRecorder(
+                os.environ["DISCODE_TRAFFIC_FILE"])
+            self.background_tasks.append(
+                self.loop.create_task(self.traffic_recorder.run()))
+        self.metrics = metrics.MetricsRegistry()
+        self.commands_latency = self.metrics.histogram(
+            "discode_command_duration_seconds",
+            "Duration of the commands, by command name")
+        self.background_tasks.append(
+            self.loop.create_task(self.metrics.measure_loop_lag(self.loop)))
+        # Set by the supervisor of the launcher when it restarts the bot
+        # after a crash
+        self.crashed_at = None
+        if os.environ.get("DISCODE_RESTARTS"):
+            self.metrics.gauge(
+                "discode_restarts",
+                "Restarts of the process by the supervisor").set(
+                    int(os.environ["DISCODE_RESTARTS"]))
+            self.metrics.gauge(
+                "discode_last_exit_code",
+                "Exit code of the process before its last restart").set(
+                    int(os.environ["DISCODE_LAST_EXIT_CODE"]))
+            self.crashed_at = float(os.environ["DISCODE_CRASHED_AT"])
+        self.tracer = tracing.Tracer()
+        # Records the callbacks blocking the event loop for more than this
+        # number of seconds
+        self.watchdog = watchdog.LoopWatchdog(
+            float(os.environ.get("DISCODE_BLOCKING_THRESHOLD", "0.5")))
+        self.background_tasks.append(self.loop.create_task(self.watchdog.run()))
+        # Opt-in metrics endpoint, only reachable locally. The processes of
+        # a cluster use the following ports
+        if os.environ.get("DISCODE_METRICS_PORT"):
+            self.loop.create_task(
+                self.metrics.start_server(
+                    "127.0.0.1",
+                    int(os.environ["DISCODE_METRICS_PORT"]) +
+                    (cluster_id or 0)))
+        if cluster_id is None:
+            clear()
 
     async def close(self):
+        for task in self.background_tasks:
+            task.cancel()
         await super().close()
         await self.session.close()
+        await self.metrics.stop_server()
+        self.watchdog.stop()
+        if self.traffic_recorder:
+            self.traffic_recorder.close()
+
+    async def invoke(self, ctx):
+        if ctx.command and self.draining:
+            await ctx.channel.send("The bot is restarting, please try again "
+                                   "in a few seconds.")
+            return
+        begin = time.perf_counter()
+        task = asyncio.current_task()
+        if ctx.command:
+            ctx.trace = self.tracer.start(ctx.command.qualified_name,
+                                          message=ctx.message.id)
+            self.invocations.add(task)
+        try:
+            await super().invoke(ctx)
+        finally:
+            self.invocations.discard(task)
+        if ctx.command:
+            status = "error" if ctx.command_failed else "ok"
+            self.commands_latency.observe(time.perf_counter() - begin,
+                                          command=ctx.command.qualified_name,
+                                          status=status)
+            self.tracer.finish(ctx.trace, status)
+
+    async def drain(self, deadline: float = None):
+        """Shuts the bot down without losing work: stops accepting
+        commands, waits for the ones being executed (the runs) for up to
+        `deadline` seconds, saves the state of the modules (see their flush
+        method), then closes the bot"""
+        if self.draining:
+            return
+        self.draining = True
+        if deadline is None:
+            deadline = self.drain_deadline
+        pending = self.invocations - {asyncio.current_task()}
+        if pending:
+            print("Waiting for " + str(len(pending)) + " commands to finish")
+            _, pending = await asyncio.wait(pending, timeout=deadline)
+            if pending:
+                print(str(len(pending)) + " commands didn't finish in time")
+        for cog in list(self.cogs.values()):
+            if hasattr(cog, "flush"):
+                try:
+                    await cog.flush()
+                except Exception as e:
+                    print("Couldn't save the state of the " +
+                          cog.qualified_name + " module: " + str(e))
+        await self.close()
+
+    async def on_command(self, ctx):
+        """Triggers AFTER a command is called"""
+        self.total_commands += 1
+
+    def update_prefixes(self):
+        """Builds the prefixes of the commands: the mentions of the bot (once
+        it's logged in), then its prefix. Must be called when one of them
+        changes"""
+        self.prefixes = (self.prefix,)
+        if self.user:
+            self.prefixes = ("<@!" + str(self.user.id) + "> ",
+                             "<@" + str(self.user.id) + "> ", self.prefix)
+        self.code_block_prefix = self.prefix + "code```"
+
+    async def on_message(self, message):
+        """Triggers when the bot reads a new message"""
+        # Most messages aren't commands
+        if not message.content.startswith(self.prefixes) \
+                or message.author.id in self.blacklist:
+            return
+        if self.traffic_recorder:
+            self.traffic_recorder.record(message, self.prefixes)
+        if message.content.startswith(self.code_block_prefix):
+            await message.channel.send("https://i.imgur.com/eGMJXqg.png")
+        else:
+            await self.process_commands(message)
+
+    async def on_command_error(self, ctx, error):
+        await ctx.message.channel.send(error)
 
 
-def run_bot():
-    """Runs the bot"""
+class ShardedDiscode(Discode, commands.AutoShardedBot):
+    """The bot, using several gateway connections (shards). The process
+    handles the shards `shard_ids` among `shard_count` (all of them by
+    default)"""
+
+
+def run_bot(shard_ids: list = None, shard_count: int = None,
+            cluster_id: int = None):
+    """Runs the bot. It's sharded if shard_count is set"""
 
     loop = asyncio.get_event_loop()
 
-    bot = Discode(loop)
+    if shard_count:
+        bot = ShardedDiscode(loop,
+                             cluster_id,
+                             shard_ids=shard_ids,
+                             shard_count=shard_count)
+    else:
+        bot = Discode(loop)
 
     @bot.event
     async def on_ready():
         """Triggers when the bot just logged in"""
 
+        bot.stats.reset(bot.guilds)
+        bot.update_prefixes()
         print("Logged in as " + bot.user.name + "#" + bot.user.discriminator)
-        print(str(len(bot.guilds)) + " servers")
-        print(str(len(set(bot.get_all_channels()))) + " channels")
-        print(str(len(set(bot.get_all_members()))) + " members")
+        print(str(bot.stats.guilds) + " servers")
+        print(
+            str(bot.stats.text_channels + bot.stats.voice_channels) +
+            " channels")
+        print(str(bot.stats.members) + " members")
+        rss = memory.get_rss()
+        print("Memory usage: " +
+              (memory.format_size(rss) if rss else "unknown") +
+              (" (low-memory mode)" if bot.low_memory else ""))
         bot.invite_link = "https://discordapp.com/oauth2/authorize?client_id="\
             + str(bot.user.id) + "&scope=bot"
         print("\nHere's the invitation link for your bot: " + bot.invite_link)
-        bot.load_modules()
         bot.launched_at = datetime.now()
-        print("\n" + str(len(bot.loaded_modules)) + " modules loaded.")
-
-    @bot.event
-    async def on_command(ctx):
-        """Triggers AFTER a command is called"""
-        bot.total_commands += 1
-
-    @bot.event
-    async def on_message(message):
-        """Triggers when the bot reads a new message"""
-        if message.author.id not in bot.blacklist:
-            if message.content.startswith(bot.prefix + "code```"):
-                await bot.send_message(
-                    destination=message.channel,
-                    content="https://i.imgur.com/eGMJXqg.png")
-            else:
-                await bot.process_commands(message)
-
-    @bot.event
-    async def on_command_error(ctx, error):
-        await ctx.message.channel.send(error)
-
+        if bot.crashed_at:
+            bot.metrics.gauge(
+                "discode_restart_duration_seconds",
+                "Time between the last crash and the bot being ready").set(
+                    time.time() - bot.crashed_at)
+            bot.crashed_at = None
+
+    async def handle_sigterm():
+        """Drains the bot on SIGTERM (e.g. sent by the supervisor, or by a
+        container runtime) and on SIGINT (Ctrl+C, which also reaches the
+        processes started by the launcher). Set once the loop runs, as
+        Client.run sets its own handlers, which stop the loop right away"""
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(signal_number,
+                                        lambda: loop.create_task(bot.drain()))
+            except NotImplementedError:
+                pass
+
+    # The modules are loaded once, they do their network initialization in
+    # the background once the bot is ready
+    bot.load_modules()
+    loop.create_task(handle_sigterm())
     try:
         bot.run(bot.token, reconnect=True)
     except discord.LoginFailure:
         print("Couldn't log in, your bot's token might be incorrect! "
               "If it's not, then check Discord's status here: "
               "https://status.discordapp.com/")
-        answer = input("Do you want to change your bot's token? (yes/no)\n> ")
-        if answer.upper() == "YES":
-            token = input("\n\nPlease put your new bot's token here:\n> ")
-            json_data = utils.load_json("settings/infos.json")
-            json_data["token"] = token
-            bot.token = token
-            utils.save_json(json_data, "settings/infos.json")
+        # The token of the environment can't be changed here
+        if sys.stdin.isatty() and "DISCODE_TOKEN" not in os.environ:
+            answer = input(
+                "Do you want to change your bot's token? (yes/no)\n> ")
+            if answer.upper() == "YES":
+                token = input("\n\nPlease put your new bot's token here:\n> ")
+                json_data = utils.load_json(bot.config_file_path)
+                json_data["token"] = token
+                bot.token = token
+                utils.save_json(json_data, bot.config_file_path)
     except KeyboardInterrupt:
         loop.run_util_complete(bot.close())
     except discord.GatewayNotFound:
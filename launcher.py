@@ -1,8 +1,11 @@
 """Runs bot"""
 
+import argparse
 import os
 import subprocess
 import sys
+import threading
+import time
 
 # USEFUL FUNCTIONS
 if sys.platform == "win32" or sys.platform == "win64":
@@ -15,20 +18,42 @@ else:
         return os.system("clear")
 
 
+def is_up_to_date(timeout: float = 10):
+    """Checks if there are some available updates for the bot, gives up
+    (and considers it's up-to-date) after `timeout` seconds"""
+    try:
+        subprocess.run(["git", "fetch"],
+                       stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL,
+                       timeout=timeout)
+        result = subprocess.check_output(["git", "status"], timeout=timeout)
+    except (OSError, subprocess.SubprocessError):
+        return True
+    return "Your branch is behind" not in str(result)
+
+
 def check_updates():
-    """Checks if there are some available updates for the bot"""
-    subprocess.call("git fetch",
-                    stdout=open(os.devnull, 'w'),
-                    stderr=subprocess.STDOUT,
-                    shell=True)
-    result = subprocess.check_output("git status", shell=True)
-    if "Your branch is behind" in str(result):
+    """Checks if there are some available updates for the bot, and asks
+    for updating it"""
+    if not is_up_to_date():
         answer = input(
             "The bot isn't up-to-date, please type 'yes' to update it!\n\n> ")
         if answer.upper() == "YES":
             os.system("git pull")
 
 
+def check_updates_in_background():
+    """Checks if there are some available updates for the bot while it
+    starts, without asking anything"""
+
+    def check():
+        if not is_up_to_date():
+            print("The bot isn't up-to-date, run \"git pull\" and restart "
+                  "it to update it.")
+
+    threading.Thread(target=check, name="updates", daemon=True).start()
+
+
 def ask_user():
     """Asks user for installing requirements/launching the bot"""
     answer = ""
@@ -54,7 +79,170 @@ def install_requirements():
                     shell=True)
 
 
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Runs the bot.")
+    parser.add_argument(
+        "--shards",
+        type=int,
+        help="number of shards (gateway connections), the bot isn't sharded "
+        "by default")
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="number of processes the shards are split between")
+    parser.add_argument("--run",
+                        action="store_true",
+                        help="runs the bot without showing the menu")
+    parser.add_argument(
+        "--supervise",
+        action="store_true",
+        help="restarts the bot (or each process) when it crashes")
+    # Used by the cluster to start its processes
+    parser.add_argument("--shard-ids",
+                        type=int,
+                        nargs="+",
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--cluster-id", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.processes > 1 and not args.shards:
+        parser.error("--processes requires --shards")
+    if args.shards and args.processes > args.shards:
+        parser.error("there can't be more processes than shards")
+    return args
+
+
+def split_shards(shard_count: int, processes: int):
+    """Splits the shards in `processes` ranges"""
+    ranges = []
+    begin = 0
+    for i in range(processes):
+        end = begin + shard_count // processes + \
+            (1 if i < shard_count % processes else 0)
+        ranges.append(list(range(begin, end)))
+        begin = end
+    return ranges
+
+
+def supervise(command: list, name: str, stop: threading.Event,
+              processes: dict):
+    """Runs `command` until it exits successfully or `stop` is set. It's
+    restarted right after its first crash, then after delays doubling up
+    to a minute while it keeps crashing. The current process is
+    processes[name]"""
+    restarts = 0
+    delay = 0
+    env = dict(os.environ)
+    while not stop.is_set():
+        began_at = time.monotonic()
+        processes[name] = subprocess.Popen(command, env=env)
+        exit_code = processes[name].wait()
+        if exit_code == 0 or stop.is_set():
+            return
+        # It had been running fine for a while
+        if time.monotonic() - began_at > 60:
+            delay = 0
+        restarts += 1
+        print(name + " exited with code " + str(exit_code) +
+              ", restarting it" + (" in " + str(delay) + "s" if delay else "") +
+              " (restart " + str(restarts) + ")")
+        # The bot reports them in its metrics
+        env["DISCODE_RESTARTS"] = str(restarts)
+        env["DISCODE_LAST_EXIT_CODE"] = str(exit_code)
+        env["DISCODE_CRASHED_AT"] = str(time.time())
+        if stop.wait(delay):
+            return
+        delay = min(max(delay * 2, 1), 60)
+
+
+def run_processes(commands: dict, supervised: bool):
+    """Runs the commands (by process name) in parallel, restarting them
+    when they crash if `supervised`. Stops them on Ctrl+C"""
+    stop = threading.Event()
+    processes = {}
+
+    def run(command: list, name: str):
+        if supervised:
+            supervise(command, name, stop, processes)
+        else:
+            processes[name] = subprocess.Popen(command)
+            processes[name].wait()
+
+    threads = [
+        threading.Thread(target=run, args=(command, name))
+        for name, command in commands.items()
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1)
+    except KeyboardInterrupt:
+        stop.set()
+        for process in list(processes.values()):
+            process.terminate()
+        for thread in threads:
+            thread.join()
+
+
+def is_configured():
+    """Checks if the bot can start without asking for its settings"""
+    return os.path.exists("settings/config.json") \
+        or "DISCODE_TOKEN" in os.environ
+
+
+def run_cluster(shard_count: int, processes: int, supervised: bool = False):
+    """Runs the bot in several processes, each one handling a range of
+    shards. The processes share the settings and data files"""
+    # The processes can't ask for the missing settings
+    if not is_configured():
+        print("The bot must be configured before running it in cluster "
+              "mode. Please run it once without the --processes option, "
+              "or set the DISCODE_* environment variables.")
+        sys.exit(1)
+    commands = {}
+    for cluster_id, shard_ids in enumerate(
+            split_shards(shard_count, processes)):
+        print("Starting process " + str(cluster_id) + " (shards " +
+              str(shard_ids[0]) + " to " + str(shard_ids[-1]) + ")")
+        commands["Process " + str(cluster_id)] = [
+            sys.executable, "launcher.py", "--shards",
+            str(shard_count), "--cluster-id",
+            str(cluster_id), "--shard-ids"
+        ] + [str(shard_id) for shard_id in shard_ids]
+    run_processes(commands, supervised)
+
+
+def run_supervised(shard_count: int = None):
+    """Runs the bot in a child process, restarted when it crashes"""
+    if not is_configured():
+        print("The bot must be configured before supervising it. Please run "
+              "it once without the --supervise option, or set the DISCODE_* "
+              "environment variables.")
+        sys.exit(1)
+    command = [sys.executable, "launcher.py", "--run"]
+    if shard_count:
+        command += ["--shards", str(shard_count)]
+    run_processes({"The bot": command}, True)
+
+
 if __name__ == "__main__":
-    check_updates()
-    clear()
-    ask_user()
+    ARGS = parse_arguments()
+    if ARGS.cluster_id is not None:
+        from bot import run_bot
+        run_bot(ARGS.shard_ids, ARGS.shards, ARGS.cluster_id)
+    elif ARGS.processes > 1:
+        check_updates_in_background()
+        run_cluster(ARGS.shards, ARGS.processes, ARGS.supervise)
+    elif ARGS.supervise:
+        check_updates_in_background()
+        run_supervised(ARGS.shards)
+    elif ARGS.shards or ARGS.run:
+        check_updates_in_background()
+        from bot import run_bot
+        run_bot(shard_count=ARGS.shards)
+    else:
+        check_updates()
+        clear()
+        ask_user()
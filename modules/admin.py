@@ -2,7 +2,7 @@
 import discord
 from discord.ext import commands
 from modules.utils import checks
-from modules.utils import utils
+from modules.utils.cache import LRUCache
 
 
 class Admin(commands.Cog):
@@ -11,18 +11,32 @@ class Admin(commands.Cog):
     def __init__(self, bot):
         """Init function"""
         self.bot = bot
+        # Users fetched by list_blacklist, by ID. The members may not be
+        # cached (see the low-memory mode of the bot)
+        self.users = LRUCache(64)
+
+    async def get_user(self, user_id: int):
+        """Returns an user from the cache of the bot, or fetches it. Returns
+        None if it doesn't exist"""
+        user = self.bot.get_user(user_id) or self.users.get(user_id)
+        if not user:
+            try:
+                user = await self.bot.fetch_user(user_id)
+            except discord.NotFound:
+                return None
+            self.users[user_id] = user
+        return user
 
     @commands.command()
     @checks.is_owner()
-    async def add_blacklist(self, ctx, user: discord.Member):
+    async def add_blacklist(self, ctx, user: discord.User):
         """Adds an user to the bot's blacklist
         Parameters:
             user: The user you want to add to the bot's blacklist.
 
         Example: [p]add_blacklist @AVeryMeanUser"""
         if user.id not in self.bot.blacklist:
-            self.bot.blacklist.append(user.id)
-            utils.save_json(self.bot.blacklist, self.bot.blacklist_file_path)
+            await self.bot.add_to_blacklist(user.id)
             await ctx.channel.send("Done.")
         else:
             await ctx.channel.send(user.name + "#" + user.discriminator + " (" +
@@ -37,23 +51,21 @@ class Admin(commands.Cog):
 
         Example: [p]add_blacklist_id 346654353341546499"""
         if user_id not in self.bot.blacklist:
-            self.bot.blacklist.append(user_id)
-            utils.save_json(self.bot.blacklist, self.bot.blacklist_file_path)
+            await self.bot.add_to_blacklist(user_id)
             await ctx.channel.send("Done.")
         else:
             await ctx.channel.send("This ID is already in the blacklist.")
 
     @commands.command()
     @checks.is_owner()
-    async def remove_blacklist(self, ctx, user: discord.Member):
+    async def remove_blacklist(self, ctx, user: discord.User):
         """Removes an user from the bot's blacklist
         Parameters:
             user: The user you want to remove from the bot's blacklist.
 
         Example: [p]rem_blacklist @AGoodGuyUnfairlyBlacklisted"""
         if user.id in self.bot.blacklist:
-            self.bot.blacklist.remove(user.id)
-            utils.save_json(self.bot.blacklist, self.bot.blacklist_file_path)
+            await self.bot.remove_from_blacklist(user.id)
             await ctx.channel.send("Done.")
         else:
             await ctx.channel.send("This user wasn't even blacklisted.")
@@ -68,8 +80,7 @@ class Admin(commands.Cog):
 
         Example: [p]rem_blacklist @AGoodGuyUnfairlyBlacklisted"""
         if user_id in self.bot.blacklist:
-            self.bot.blacklist.remove(user_id)
-            utils.save_json(self.bot.blacklist, self.bot.blacklist_file_path)
+            await self.bot.remove_from_blacklist(user_id)
             await ctx.channel.send("Done.")
         else:
             await ctx.channel.send("This ID wasn't even in the blacklist.")
@@ -82,9 +93,8 @@ class Admin(commands.Cog):
             msg = ("```Markdown\nList of blacklisted users:"
                    "\n=================\n\n")
             has_unknown = False
-            for i, user_id in enumerate(self.bot.blacklist):
-                user = discord.utils.find(lambda u, u_id=user_id: u.id == u_id,
-                                          self.bot.get_all_members())
+            for i, user_id in enumerate(sorted(self.bot.blacklist)):
+                user = await self.get_user(user_id)
                 msg += f"{i+1}. "
                 if user:
                     msg += f"{user} ({user.id})\n"
@@ -93,8 +103,8 @@ class Admin(commands.Cog):
                     msg += f"UNKNOWN USER ({user_id})\n"
             msg += "```"
             if has_unknown:
-                msg += ("\n`UNKNOWN USER` means that this user hasn't any "
-                        "server in common with the bot.")
+                msg += ("\n`UNKNOWN USER` means that this user doesn't "
+                        "exist anymore.")
             await ctx.channel.send(msg)
         else:
             await ctx.channel.send("There is no blacklisted users.")
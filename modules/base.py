@@ -1,18 +1,23 @@
 """Owner module"""
 
+import aiohttp
 import discord
 import traceback
 import textwrap
 import inspect
 import asyncio
 import io
-import requests
 import subprocess
+import os
 import platform
 from modules.utils import utils
 from discord.ext import commands
 from modules.utils import checks
+from modules.utils import memory
+from modules.utils import profiler
+from modules.utils import tracing
 from datetime import datetime
+import time
 from os import listdir
 from contextlib import redirect_stdout
 
@@ -25,9 +30,19 @@ class Base(commands.Cog):
         self.last_result = None
         self.sessions = set()
         self.infos_updater = self.bot.loop.create_task(self.update_infos())
+        self.profiler = profiler.SamplingProfiler()
+        self.profiler_task = None
+        self.memory_tracker = memory.MemoryTracker()
+        self.environment = None
+        self.stats_folder_path = "settings/stats/"
 
     def cog_unload(self):
         self.infos_updater.cancel()
+        if self.profiler_task:
+            self.profiler_task.cancel()
+        self.profiler.stop()
+        if self.memory_tracker.tracing:
+            self.memory_tracker.stop()
 
     def cleanup_code(self, content):
         """Automatically removes code blocks from the code."""
@@ -43,21 +58,99 @@ class Base(commands.Cog):
             return f'```py\n{e.__class__.__name__}: {e}\n```'
         return f'```py\n{e.text}{"^":>{e.offset}}\n{e.__class__.__name__}: {e}```'
 
-    def save_infos(self):
-        json_data = {}
+    async def save_infos(self):
+        """Saves the info of the bot. The new commands are added to the ones
+        of the file, as the other processes of a cluster count theirs too"""
+        total_commands = self.bot.total_commands
+        new_commands = total_commands - self.bot.saved_total_commands
         delta = datetime.now() - self.bot.launched_at
-        json_data["total runtime"] = int(
-            (self.bot.total_runtime + delta).total_seconds())
-        json_data["total commands"] = self.bot.total_commands
-        json_data["created at"] = self.bot.created_at.strftime(
-            "%d/%m/%Y %H:%M:%S")
-        utils.save_json(json_data, self.bot.info_file_path)
+        total_runtime = int((self.bot.total_runtime + delta).total_seconds())
+
+        def update(json_data: dict):
+            json_data["total commands"] += new_commands
+            # The run time of a cluster is the one of its first process
+            if not self.bot.cluster_id:
+                json_data["total runtime"] = total_runtime
+
+        json_data = await utils.update_json_async(
+            self.bot.info_file_path, update, {
+                "total commands": 0,
+                "total runtime": 0,
+                "created at": self.bot.created_at.strftime("%d/%m/%Y %H:%M:%S")
+            })
+        self.bot.saved_total_commands = json_data["total commands"]
+        self.bot.total_commands = json_data["total commands"] + \
+            self.bot.total_commands - total_commands
+
+    async def flush(self):
+        """Saves the state of the module before the bot shuts down"""
+        await self.save_infos()
+
+    async def share_stats(self):
+        """Saves the statistics of this process of the cluster, and loads
+        the ones of the other processes"""
+        stats = self.bot.stats.to_dict()
+        stats["updated_at"] = time.time()
+        file_name = str(self.bot.cluster_id) + ".json"
+
+        def share():
+            if not os.path.isdir(self.stats_folder_path):
+                os.makedirs(self.stats_folder_path)
+            utils.save_json(stats, self.stats_folder_path + file_name)
+            cluster_stats = {}
+            for other_file_name in os.listdir(self.stats_folder_path):
+                if other_file_name.endswith(".json") \
+                        and other_file_name != file_name:
+                    other_stats = utils.load_json(self.stats_folder_path +
+                                                  other_file_name)
+                    # Ignore the processes which aren't running anymore
+                    if time.time() - other_stats["updated_at"] < 180:
+                        cluster_stats[other_file_name[:-5]] = other_stats
+            return cluster_stats
+
+        self.bot.cluster_stats = await self.bot.loop.run_in_executor(
+            None, share)
+
+    def get_total_stats(self):
+        """Returns the statistics of the bot, all the processes included"""
+        total_stats = self.bot.stats.to_dict()
+        for stats in self.bot.cluster_stats.values():
+            for name in total_stats:
+                total_stats[name] += stats[name]
+        return total_stats
 
     async def update_infos(self):
-        while not self.bot.is_closed:
-            self.save_infos()
+        while not self.bot.is_closed():
+            await self.save_infos()
+            if self.bot.cluster_id is not None:
+                await self.share_stats()
             await asyncio.sleep(60)
 
+    async def get_environment(self):
+        """Returns the versions of Python and of the bot (commit) and the
+        OS. They don't change while the bot runs, so they are only computed
+        once"""
+        if not self.environment:
+            python_version = "Python " + platform.python_version() + " " + \
+                platform.architecture()[0][:-3] + " bits"
+            try:
+                commit = (await self.bot.loop.run_in_executor(
+                    None, subprocess.check_output,
+                    ["git", "rev-parse", "HEAD"])).decode("utf-8").strip()
+            except (OSError, subprocess.CalledProcessError):
+                commit = "Unknown"
+            os_infos = "Running on " + platform.platform()
+            if platform.machine().endswith("64"):
+                os_infos += " 64 bits"
+            else:
+                os_infos += " 32 bits"
+            self.environment = {
+                "python_version": python_version,
+                "commit": commit,
+                "os_infos": os_infos
+            }
+        return self.environment
+
     @commands.command()
     async def invite(self, ctx):
         """Gets invitation link"""
@@ -210,6 +303,182 @@ class Base(commands.Cog):
             except discord.HTTPException as e:
                 await ctx.channel.send(f'Unexpected error: `{e}`')
 
+    async def send_profile(self, channel):
+        """Sends the top functions of the last profile and its collapsed
+        stacks"""
+        nb_samples = sum(self.profiler.samples.values())
+        if not nb_samples:
+            await channel.send("No samples collected.")
+            return
+        top_functions = self.profiler.format_top_functions()
+        if len(top_functions) > 1900:
+            top_functions = top_functions[:1900]
+            top_functions = top_functions[:top_functions.rfind("\n")]
+        await channel.send(
+            str(nb_samples) + " samples:```\n" + top_functions + "\n```",
+            file=discord.File(
+                io.BytesIO(self.profiler.collapsed_stacks().encode("utf-8")),
+                "profile.collapsed"))
+
+    async def stop_profiler_later(self, channel, seconds: int):
+        await asyncio.sleep(seconds)
+        self.profiler.stop()
+        self.profiler_task = None
+        await self.send_profile(channel)
+
+    @commands.group()
+    @checks.is_owner()
+    async def profile(self, ctx):
+        """Profiles the bot (CPU)"""
+        if ctx.invoked_subcommand is None:
+            await ctx.send_help(ctx.command)
+
+    @profile.command(name="start")
+    async def profile_start(self, ctx, seconds: int = 30):
+        """Samples the bot for some seconds, then sends the top functions
+        and a collapsed stacks file (for flamegraphs)"""
+        if self.profiler.running:
+            await ctx.channel.send("The profiler is already running.")
+            return
+        if seconds <= 0:
+            await ctx.channel.send("Please provide a positive duration.")
+            return
+        self.profiler.start()
+        self.profiler_task = self.bot.loop.create_task(
+            self.stop_profiler_later(ctx.channel, seconds))
+        await ctx.channel.send("Profiling for " + str(seconds) +
+                               " seconds...")
+
+    @profile.command(name="stop")
+    async def profile_stop(self, ctx):
+        """Stops the profiler before the end of its duration"""
+        if not self.profiler.running:
+            await ctx.channel.send("The profiler isn't running.")
+            return
+        self.profiler_task.cancel()
+        self.profiler_task = None
+        self.profiler.stop()
+        await self.send_profile(ctx.channel)
+
+    async def send_report(self, ctx, message: str, report: str,
+                          file_name: str):
+        await ctx.channel.send(message,
+                               file=discord.File(
+                                   io.BytesIO(report.encode("utf-8")),
+                                   file_name))
+
+    def get_structures(self):
+        """Returns the big data structures of the bot, by name"""
+        structures = {"blacklist": self.bot.blacklist}
+        code = self.bot.get_cog("Code")
+        if code:
+            structures["Code.configuration"] = code.configuration
+            structures["Code.users_configuration"] = \
+                code.users_configuration
+            structures["Code.pastes"] = code.pastes.data
+            structures["Code.histories"] = code.histories.data
+        return structures
+
+    @commands.group(name="memory")
+    @checks.is_owner()
+    async def memory_command(self, ctx):
+        """Diagnoses the memory usage of the bot"""
+        if ctx.invoked_subcommand is None:
+            await ctx.send_help(ctx.command)
+
+    @memory_command.command(name="start")
+    async def memory_start(self, ctx, nb_frames: int = 1):
+        """Starts tracing the allocations (it slows the bot down), the
+        current state is the baseline"""
+        if self.memory_tracker.tracing:
+            self.memory_tracker.reset_baseline()
+            await ctx.channel.send("Baseline reset.")
+        else:
+            self.memory_tracker.start(nb_frames)
+            await ctx.channel.send("Tracing the allocations.")
+
+    @memory_command.command(name="snapshot")
+    async def memory_snapshot(self, ctx, count: int = 25):
+        """Sends the top allocation sites and the differences with the
+        baseline"""
+        if not self.memory_tracker.tracing:
+            await ctx.channel.send("The allocations aren't traced, use `" +
+                                   self.bot.prefix + "memory start` first.")
+            return
+        await self.send_report(ctx, "Here is the snapshot:",
+                               self.memory_tracker.report(count),
+                               "snapshot.txt")
+
+    @memory_command.command(name="stop")
+    async def memory_stop(self, ctx):
+        """Stops tracing the allocations"""
+        if not self.memory_tracker.tracing:
+            await ctx.channel.send("The allocations aren't traced.")
+            return
+        self.memory_tracker.stop()
+        await ctx.channel.send("Done! :ok_hand:")
+
+    @memory_command.command(name="census")
+    async def memory_census(self, ctx):
+        """Counts the live objects by type, and the objects of the big
+        structures of the bot"""
+        rss = memory.get_rss()
+        lines = [
+            "RSS: " + (memory.format_size(rss) if rss else "unknown") +
+            (" (low-memory mode)" if self.bot.low_memory else ""), "",
+            "Discord cache:", "guilds: " + str(len(self.bot.guilds)),
+            "members: " +
+            str(sum(len(guild.members) for guild in self.bot.guilds)),
+            "channels: " +
+            str(sum(len(guild.channels) for guild in self.bot.guilds)),
+            "roles: " + str(sum(len(guild.roles) for guild in self.bot.guilds)),
+            "users: " + str(len(self.bot.users)),
+            "messages: " + str(len(self.bot.cached_messages))
+        ]
+        for name, structure in self.get_structures().items():
+            census = memory.structure_census(structure)
+            lines += [
+                "", name + ": " +
+                str(sum(count for count, _ in census.values())) +
+                " objects, " +
+                memory.format_size(sum(size for _, size in census.values()))
+            ]
+            lines += [
+                "    " + type_name + ": " + str(count) + " (" +
+                memory.format_size(size) + ")"
+                for type_name, (count, size) in sorted(
+                    census.items(), key=lambda item: item[1][1], reverse=True)
+            ]
+        lines += ["", "Objects tracked by the garbage collector:"]
+        lines += [
+            "    " + type_name + ": " + str(count)
+            for type_name, count in memory.gc_census()
+        ]
+        await self.send_report(ctx, "Here is the census:", "\n".join(lines),
+                               "census.txt")
+
+    @commands.command()
+    @checks.is_owner()
+    async def blocking(self, ctx):
+        """Shows the last callbacks which blocked the event loop, with their
+        stack"""
+        records = list(self.bot.watchdog.records)
+        if not records:
+            await ctx.channel.send(
+                "The event loop hasn't been blocked for more than " +
+                str(self.bot.watchdog.threshold) + "s.")
+            return
+        report = "\n\n".join(
+            datetime.fromtimestamp(record["time"]).strftime(
+                "%d/%m/%Y %H:%M:%S") + " - blocked for " + "%.3f" %
+            record["duration"] + "s\n" + record["stack"]
+            for record in reversed(records))
+        await self.send_report(
+            ctx,
+            str(len(records)) + " blocking callback" +
+            ("s" if len(records) > 1 else "") + " recorded.", report,
+            "blocking.txt")
+
     @commands.command()
     @checks.is_owner()
     async def load(self, ctx, module: str):
@@ -218,8 +487,8 @@ class Base(commands.Cog):
             self.bot.load_extension("modules." + module)
             if module not in self.bot.loaded_modules:
                 self.bot.loaded_modules.append(module)
-                utils.save_json(self.bot.loaded_modules,
-                                self.bot.modules_file_path)
+                await utils.save_json_async(self.bot.loaded_modules,
+                                            self.bot.modules_file_path)
         except Exception:
             tb = traceback.format_exc()
             await ctx.channel.send("\U0001f52b\n```" + tb + "```")
@@ -235,8 +504,8 @@ class Base(commands.Cog):
             try:
                 self.bot.unload_extension("modules." + module)
                 self.bot.loaded_modules.remove(module)
-                utils.save_json(self.bot.loaded_modules,
-                                self.bot.modules_file_path)
+                await utils.save_json_async(self.bot.loaded_modules,
+                                            self.bot.modules_file_path)
             except Exception:
                 tb = traceback.format_exc()
                 await ctx.channel.send("\U0001f52b\n```" + tb + "```")
@@ -252,14 +521,21 @@ class Base(commands.Cog):
         """Reloads a module."""
         try:
             if module in self.bot.loaded_modules:
+                # The new cogs take over the state of the current ones
+                for cog in list(self.bot.cogs.values()):
+                    if cog.__module__ == "modules." + module \
+                            and hasattr(cog, "export_state"):
+                        self.bot.cogs_states[cog.qualified_name] = \
+                            cog.export_state()
                 self.bot.unload_extension("modules." + module)
                 self.bot.loaded_modules.remove(module)
-                utils.save_json(self.bot.loaded_modules,
-                                self.bot.modules_file_path)
+                await utils.save_json_async(self.bot.loaded_modules,
+                                            self.bot.modules_file_path)
 
             self.bot.load_extension("modules." + module)
             self.bot.loaded_modules.append(module)
-            utils.save_json(self.bot.loaded_modules, self.bot.modules_file_path)
+            await utils.save_json_async(self.bot.loaded_modules,
+                                        self.bot.modules_file_path)
         except Exception:
             tb = traceback.format_exc()
             await ctx.channel.send("\U0001f52b\n```" + tb + "```")
@@ -284,10 +560,9 @@ class Base(commands.Cog):
     @commands.command()
     @checks.is_owner()
     async def shutdown(self, ctx):
-        """Shutdowns the bot"""
-        self.save_infos()
+        """Shutdowns the bot, once the commands being executed finished"""
         await ctx.channel.send("Bye! :wave:")
-        await self.bot.logout()
+        await self.bot.drain()
 
     @commands.command()
     @checks.is_owner()
@@ -298,20 +573,24 @@ class Base(commands.Cog):
             become the new bot's avatar
 
         Example: [p]set_avatar http://i.imgur.com/bjmbH1e.png"""
-        r = requests.get(avatar_link)
-        if r.status_code == 200:
+        try:
+            async with self.bot.session.get(avatar_link) as response:
+                status = response.status
+                avatar = await response.read()
+        except (aiohttp.ClientError, ValueError):
+            await ctx.channel.send("Invalid URL")
+            return
+        if status == 200:
             try:
-                await self.bot.user.edit(avatar=r.content)
+                await self.bot.user.edit(avatar=avatar)
                 await ctx.channel.send("Done!")
             except discord.HTTPException as e:
                 await ctx.channel.send(e)
             except discord.InvalidArgument:
                 await ctx.channel.send("Wrong image format")
-            except requests.exceptions.MissingSchema:
-                await ctx.channel.send("Invalid URL")
         else:
             await ctx.channel.send(
-                "Error " + str(r.status_code) +
+                "Error " + str(status) +
                 ": The link must be incorrect, " +
                 "make sure the link finishes with `.png`, `.jpg`, `.jpeg`, etc")
 
@@ -485,36 +764,63 @@ class Base(commands.Cog):
             except discord.HTTPException:
                 await ctx.channel.send("HTTP Error")
 
+    @commands.command()
+    @checks.is_owner()
+    async def metrics(self, ctx):
+        """Shows the metrics of the bot (latencies, errors, caches)"""
+        summary = self.bot.metrics.summarize()
+        if not summary:
+            await ctx.channel.send("No metrics yet.")
+        elif len(summary) > 1900:
+            await ctx.channel.send(
+                "Here are the metrics:",
+                file=discord.File(io.BytesIO(summary.encode("utf-8")),
+                                  "metrics.txt"))
+        else:
+            await ctx.channel.send("```\n" + summary + "\n```")
+
+    @commands.command()
+    @checks.is_owner()
+    async def traces(self, ctx, count: int = 5):
+        """Shows the slowest recent commands, stage by stage. All the recent
+        traces are attached as JSON"""
+        if not self.bot.tracer.traces:
+            await ctx.channel.send("No traces yet.")
+            return
+        waterfalls = "\n\n".join(
+            tracing.format_waterfall(trace)
+            for trace in self.bot.tracer.slowest(count))
+        files = [
+            discord.File(io.BytesIO(self.bot.tracer.export().encode("utf-8")),
+                         "traces.json")
+        ]
+        if len(waterfalls) > 1900:
+            files.append(
+                discord.File(io.BytesIO(waterfalls.encode("utf-8")),
+                             "waterfalls.txt"))
+            await ctx.channel.send("Here are the slowest traces:", files=files)
+        else:
+            await ctx.channel.send("```\n" + waterfalls + "\n```",
+                                   files=files)
+
     @commands.command()
     async def info(self, ctx):
         """Show bot's info"""
         embed = discord.Embed(title="Bot's info", type="rich embed")
-        embed.set_thumbnail(
-            url=discord.utils.find(lambda x: x.id == self.bot.user.id,
-                                   ctx.message.guild.members).avatar_url)
+        embed.set_thumbnail(url=self.bot.user.avatar_url)
         delta = datetime.now() - self.bot.created_at
         embed.set_footer(
             text="Created at " +
             self.bot.created_at.strftime("%d/%m/%Y %H:%M:%S") + " (" +
             utils.convert_seconds_to_str(delta.total_seconds()) + " ago)")
 
-        verbose_version = str(
-            subprocess.check_output("python --version", shell=True))
-        python_version = verbose_version[2:(
-            -5 if verbose_version.endswith("\\r\\n'") else -3)]
-        python_version += " " + platform.architecture()[0][:-3] + " bits"
-        commit = str(subprocess.check_output("git rev-parse HEAD",
-                                             shell=True))[2:-3]
-        os_infos = "Running on " + platform.platform()
-        if platform.machine().endswith("64"):
-            os_infos += " 64 bits"
-        else:
-            os_infos += " 32 bits"
-        embed.add_field(name="Python's version", value=python_version)
-        embed.add_field(name="Commit", value=commit)
+        environment = await self.get_environment()
+        embed.add_field(name="Python's version",
+                        value=environment["python_version"])
+        embed.add_field(name="Commit", value=environment["commit"])
         embed.add_field(name="Bot's version", value=self.bot.version)
         embed.add_field(name="Discord's version", value=discord.__version__)
-        embed.add_field(name="Environment", value=os_infos)
+        embed.add_field(name="Environment", value=environment["os_infos"])
 
         embed.add_field(name="Total commands typed",
                         value=str(self.bot.total_commands + 1))
@@ -527,19 +833,16 @@ class Base(commands.Cog):
         msg = utils.convert_seconds_to_str(delta.total_seconds())
         if msg != "":
             embed.add_field(name="Run time", value=msg)
-        embed.add_field(name="Servers", value=str(len(self.bot.guilds)))
-        nb_text_channels = 0
-        nb_voice_channels = 0
-        for server in self.bot.guilds:
-            nb_text_channels += len(server.text_channels)
-            nb_voice_channels += len(server.voice_channels)
-        embed.add_field(name="Text channels", value=str(nb_text_channels))
-        embed.add_field(name="Voice channels", value=str(nb_voice_channels))
-
-        nb_users = 0
-        for server in self.bot.guilds:
-            nb_users += server.member_count
-        embed.add_field(name="Members", value=str(nb_users))
+        stats = self.get_total_stats()
+        embed.add_field(name="Servers", value=str(stats["guilds"]))
+        embed.add_field(name="Text channels",
+                        value=str(stats["text_channels"]))
+        embed.add_field(name="Voice channels",
+                        value=str(stats["voice_channels"]))
+        embed.add_field(name="Members", value=str(stats["members"]))
+        if self.bot.cluster_id is not None:
+            embed.add_field(name="Processes",
+                            value=str(len(self.bot.cluster_stats) + 1))
         embed.add_field(name="Development server",
                         value="Join it by clicking [here](https://" +
                         self.bot.dev_server_invitation_link + ")")
@@ -549,21 +852,14 @@ class Base(commands.Cog):
     @commands.command()
     async def version(self, ctx):
         """Shows bot's version"""
-        python_version = str(
-            subprocess.check_output("python --version", shell=True))[2:-5]
-        python_version += " " + platform.architecture()[0][:-3] + " bits"
-        commit = str(subprocess.check_output("git rev-parse HEAD",
-                                             shell=True))[2:-3]
-        os_infos = "Running on " + platform.platform()
-        if platform.machine().endswith("64"):
-            os_infos += " 64 bits"
-        else:
-            os_infos += " 32 bits"
-        await ctx.channel.send("Python version: " + python_version + "\n" +
-                               "Commit: " + commit + "\n" + "Bot's version: " +
-                               self.bot.version + "\n" + "Discord's version: " +
-                               discord.__version__ + "\n" + "Environment: " +
-                               os_infos)
+        environment = await self.get_environment()
+        await ctx.channel.send("Python version: " +
+                               environment["python_version"] + "\n" +
+                               "Commit: " + environment["commit"] + "\n" +
+                               "Bot's version: " + self.bot.version + "\n" +
+                               "Discord's version: " + discord.__version__ +
+                               "\n" + "Environment: " +
+                               environment["os_infos"])
 
     @commands.command()
     async def bug(self, ctx, *, message):
@@ -1,13 +1,29 @@
 """The module which is able to run codes"""
 
+import aiohttp
+import asyncio
+import base64
+from collections import deque
 import discord
 from discord.ext import commands
 import async_timeout
-import requests
+import contextlib
+import functools
+import hashlib
+import io
 import json
+from modules.utils import engines
+from modules.utils import pages
+from modules.utils import rendering
+from modules.utils import tracing
 from modules.utils import utils
+from modules.utils import workers
+from modules.utils.cache import LRUCache
+from modules.utils.shared_cache import SharedCache
 import os
-from tzlocal import get_localzone
+import sys
+import time
+import zlib
 
 
 class Code(commands.Cog):
@@ -16,6 +32,37 @@ class Code(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.timeout = 15
+        # APIs urls, they can be changed to use other instances of these
+        # services (or fake ones, see the benchmarks)
+        self.wandbox_url = os.environ.get("DISCODE_WANDBOX_URL",
+                                          "https://wandbox.org/api/")
+        self.pastebin_url = os.environ.get("DISCODE_PASTEBIN_URL",
+                                           "https://pastebin.com/")
+        self.upstream_latency = self.bot.metrics.histogram(
+            "discode_upstream_request_duration_seconds",
+            "Duration of the requests to wandbox / pastebin")
+        self.upstream_requests = self.bot.metrics.counter(
+            "discode_upstream_requests_total",
+            "Requests to wandbox / pastebin, by response status")
+        self.cache_requests = self.bot.metrics.counter(
+            "discode_cache_requests_total", "Cache lookups, hits and misses")
+        # Opt-in worker processes executing the runs and rendering their
+        # results: DISCODE_WORKERS is their number, or "auto" for one per
+        # core
+        self.workers = None
+        if os.environ.get("DISCODE_WORKERS", "0") != "0":
+            self.workers = workers.WorkerPool(
+                None if os.environ["DISCODE_WORKERS"] == "auto" else int(
+                    os.environ["DISCODE_WORKERS"]), self.bot.loop)
+        # Maximum number of runs executed at the same time by a matrix or
+        # by tests
+        self.runs_concurrency = 4
+        # Edits of a message are taken into account during this time (in
+        # seconds) after its run
+        self.edit_window = 600
+        # A run still in progress after this time (in seconds) gets a
+        # status message showing how to cancel it, edited with its result
+        self.run_status_delay = 2
         self.data_folder_path = "data/code/"
         self.pastebin_api_key_file_path = self.data_folder_path + \
             "pastebin_key.txt"
@@ -29,7 +76,9 @@ class Code(commands.Cog):
             "languages_images.json"
         self.languages_files_extensions_file_path = self.data_folder_path + \
             "languages_files_extensions.json"
+        self.histories_folder_path = self.data_folder_path + "histories/"
         self.users_configuration = {}
+        self.users_configuration_mtime = None
         self.load_pastebin_api_key()
         self.load_users_configuration()
 
@@ -55,7 +104,126 @@ class Code(commands.Cog):
             self.languages_files_extensions_file_path)
 
         self.configuration = {}
-        self.load_info()
+
+        # Runs being executed, by run ID
+        self.runs = {}
+        self.bot.metrics.gauge("discode_runs_in_flight",
+                               "Number of runs being executed",
+                               lambda: len(self.runs))
+        self.last_run_id = 0
+        # Last executed runs, by run ID, so that their permalink can be
+        # created on demand
+        self.finished_runs = LRUCache(256)
+        # Run IDs by triggering / result message ID
+        self.messages_runs = LRUCache(512)
+        # Pastes (code, language) by url
+        self.pastes = LRUCache(128)
+        # Fetches of pastes in progress, by url
+        self.pastes_fetches = {}
+        # Opt-in cache of the results and of the pastes, shared by the
+        # processes of the bot on the host (see the cluster mode of the
+        # launcher and the workers), which survives restarts
+        self.shared_cache = None
+        self.shared_cache_ttl = 24 * 60 * 60
+        if os.environ.get("DISCODE_CACHE_FILE"):
+            self.shared_cache = SharedCache(
+                os.environ["DISCODE_CACHE_FILE"],
+                int(os.environ.get("DISCODE_CACHE_SIZE", "64")) * 1024 * 1024)
+        # Last runs of the users, by user ID. The histories of the least
+        # active users are saved on the disk
+        self.history_size = 10
+        self.histories = LRUCache(1024, self.evict_history)
+        # Saves of the evicted histories in progress, by user ID
+        self.histories_saves = {}
+        # Pages of the lists commands, rendered when the languages are
+        # loaded: by list name, and by language (upper case) for the
+        # engines
+        self.lists_pages = {}
+        self.engines_pages = {}
+        # Languages names by upper case name
+        self.languages_names = {}
+        # Pages of the config show command, by user ID
+        self.configs_pages = LRUCache(256)
+        self.paged_messages = pages.PagedMessages()
+
+        # Set once the state is handed over to a new instance of the module
+        self.state_exported = False
+        state = self.bot.cogs_states.pop(self.qualified_name, None)
+        if state:
+            self.import_state(state)
+        else:
+            # The commands of the module wait for the languages to be
+            # loaded, see cog_before_invoke
+            self.info_loader = self.bot.loop.create_task(self.load_info())
+            # Started now, so that the first runs don't wait for them
+            if self.workers:
+                self.workers.start()
+        self.render_lists()
+
+    # Attributes handed over to the new instance of the module when it's
+    # reloaded: the languages, the caches and the runs in flight (which
+    # finish with the code of the previous instance)
+    state_attributes = ("configuration", "info_loader", "users_configuration",
+                        "users_configuration_mtime", "workers",
+                        "shared_cache", "runs", "last_run_id",
+                        "finished_runs", "messages_runs", "pastes",
+                        "pastes_fetches", "histories", "histories_saves",
+                        "paged_messages")
+
+    def export_state(self):
+        """Returns the state of the module, taken over by the next instance
+        of the module (see Base.reload). This instance then doesn't release
+        it when it's unloaded"""
+        self.state_exported = True
+        return {name: getattr(self, name) for name in self.state_attributes}
+
+    def import_state(self, state: dict):
+        """Takes over the state of the previous instance of the module"""
+        if self.workers:
+            self.workers.close()
+        if self.shared_cache:
+            self.shared_cache.close()
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.histories.on_evict = self.evict_history
+
+    def cog_unload(self):
+        if self.state_exported:
+            return
+        self.info_loader.cancel()
+        if self.workers:
+            self.workers.close()
+        if self.shared_cache:
+            self.shared_cache.close()
+        for user_id, history in self.histories.items():
+            self.save_history(user_id, history)
+
+    async def cog_before_invoke(self, ctx):
+        """Waits for the languages to be loaded. Loading them again if it
+        failed. Reloads the users configuration if another process modified
+        it"""
+        if self.info_loader.done() and not self.configuration:
+            self.info_loader = self.bot.loop.create_task(self.load_info())
+        catalog = await asyncio.shield(self.info_loader)
+        # The loader may have been started by the previous instance of the
+        # module, and filled its languages instead of these ones
+        if self.configuration is not catalog:
+            self.configuration = catalog
+            self.render_lists()
+        mtime = utils.get_mtime(self.users_configuration_path)
+        if mtime and mtime != self.users_configuration_mtime:
+            self.users_configuration_mtime = mtime
+            self.users_configuration = self.decode_users_configuration(
+                await self.bot.loop.run_in_executor(
+                    None, utils.load_json, self.users_configuration_path))
+            self.configs_pages = LRUCache(256)
+
+    def decode_users_configuration(self, users_configuration: dict):
+        """Users IDs are saved as str in the JSON file"""
+        return {
+            int(user_id): user_configuration
+            for user_id, user_configuration in users_configuration.items()
+        }
 
     def load_users_configuration(self):
         """Loads the users configuration"""
@@ -66,13 +234,37 @@ class Code(commands.Cog):
             utils.save_json(self.users_configuration,
                             self.users_configuration_path)
         else:
-            self.users_configuration = utils.load_json(
-                self.users_configuration_path)
+            self.users_configuration = self.decode_users_configuration(
+                utils.load_json(self.users_configuration_path))
+        self.users_configuration_mtime = utils.get_mtime(
+            self.users_configuration_path)
+
+    async def update_users_configuration(self, function):
+        """Modifies the users configuration with `function`, which gets it
+        as saved in the file (with str users IDs). Other processes may
+        modify the file too"""
+        self.users_configuration = self.decode_users_configuration(
+            await utils.update_json_async(self.users_configuration_path,
+                                          function, {}))
+        # Other users configurations may have been modified by other
+        # processes
+        self.configs_pages = LRUCache(256)
+        self.users_configuration_mtime = utils.get_mtime(
+            self.users_configuration_path)
 
     def load_pastebin_api_key(self):
-        """Loads the pastebin api key"""
+        """Loads the pastebin api key, from the DISCODE_PASTEBIN_KEY
+        environment variable if set. Asks for it if there's none, and if
+        the bot runs in a terminal"""
 
-        if not os.path.exists(self.pastebin_api_key_file_path):
+        if "DISCODE_PASTEBIN_KEY" in os.environ:
+            self.pastebin_api_key = os.environ["DISCODE_PASTEBIN_KEY"]
+        elif not os.path.exists(self.pastebin_api_key_file_path):
+            if not sys.stdin.isatty():
+                print("No Pastebin API key! Please set DISCODE_PASTEBIN_KEY, "
+                      "long outputs can't be uploaded.")
+                self.pastebin_api_key = ""
+                return
             if not os.path.isdir("data/code"):
                 os.makedirs("data/code")
             self.pastebin_api_key = input(
@@ -86,172 +278,838 @@ class Code(commands.Cog):
 
     async def create_pastebin(self, paste_name: str, paste_code: str):
         """Creates a pastebin, returns its url"""
-        async with async_timeout.timeout(15):
-            async with self.bot.session.post(
-                    "https://pastebin.com/api/api_post.php",
-                    data={
-                        "api_dev_key": self.pastebin_api_key,
-                        "api_option": "paste",
-                        "api_paste_code": paste_code,
-                        "api_paste_private": "1",
-                        "api_paste_name": paste_name,
-                        "api_paste_expire_date": "1W"
-                    }) as response:
-                return await response.text()
-
-    def load_info(self):
-        response = requests.get("https://wandbox.org/api/list.json")
-        result = response.json()
-        for info in result:
-            language = info["language"]
-            name = info["name"]
-            # Warning: info["template"] is a list but it only contains
-            # one element at the moment. So I'm just gonna consider
-            # it as a str and not as a list. It may change in the
-            # future, I don't know ¯\_(ツ)_/¯
-            # Some languages have only one template
-            template = info["templates"][0]
-            # I don't know why there is a C++ and CPP language, as
-            # CPP language seems to be exactly the same that C++
-            # (with only 2 compilers which can be already found in
-            # C++ language). So I'm just gonna ignore that.
-            # OpenSSL isn't gonna be supported neither.
-            if language != "CPP" and language != "OpenSSL":
-                # Prettify languages names
-                if language == "Bash script":
-                    language = "Bash"
-                elif language == "Vim script":
-                    language = "Vim"
-
-                if language not in self.configuration:
-                    self.configuration[language] = {}
-                if template not in self.configuration[language]:
-                    self.configuration[language][template] = {}
-                self.configuration[language][template][name] = info
-
-                # We delete redundant info
-                # ------------------------
-                del self.configuration[language][template][name]["name"]
-                del self.configuration[language][template][name]["display-name"]
-                del self.configuration[language][template][name]["language"]
-                del self.configuration[language][template][name]["templates"]
-                # I don't know what "provider" means but as this attribute
-                # is always equal to 0, I'm just gonna ignore it.
-                del self.configuration[language][template][name]["provider"]
-                del self.configuration[language][template][name]["switches"]
+        with self.measure_upstream("pastebin", "create") as upstream_request:
+            upstream_request["status"], url = await rendering.create_pastebin(
+                self.bot.session, self.pastebin_url, self.pastebin_api_key,
+                paste_name, paste_code)
+            return url
+
+    async def upload_output(self, ctx, paste_name: str, paste_code: str):
+        """Uploads an output too long for Discord, returns its url"""
+        with tracing.span(ctx, "pastebin upload"):
+            return await self.create_pastebin(paste_name, paste_code)
+
+    @contextlib.contextmanager
+    def measure_upstream(self, service: str, endpoint: str):
+        """Measures a request to wandbox / pastebin. The status of the
+        response must be set in the yielded dict"""
+        upstream_request = {"status": "error"}
+        begin = time.perf_counter()
+        try:
+            yield upstream_request
+        finally:
+            self.record_upstream(service, endpoint, upstream_request["status"],
+                                 time.perf_counter() - begin)
+
+    def record_upstream(self, service: str, endpoint: str, status,
+                        duration: float):
+        self.upstream_latency.observe(duration,
+                                      service=service,
+                                      endpoint=endpoint)
+        self.upstream_requests.inc(service=service,
+                                   endpoint=endpoint,
+                                   status=str(status))
+
+    def record_worker_requests(self, ctx, begin: float, requests: list):
+        """Records the requests to wandbox / pastebin of a job done by a
+        worker process, which was sent at `begin` (see WorkerPool.run)"""
+        for service, endpoint, status, start, duration in requests:
+            self.record_upstream(service, endpoint, status, duration)
+            if service == "pastebin":
+                tracing.record_span(ctx, "pastebin upload", begin + start,
+                                    duration)
+
+    async def load_info(self):
+        """Loads the languages, returns them"""
+        await self.bot.wait_until_ready()
+        self.configuration = engines.build_catalog(await self.get_fetch(
+            self.wandbox_url + "list.json"))
+        self.render_lists()
+        return self.configuration
+
+    def render_lists(self):
+        """Renders the pages of the lists commands"""
+        self.languages_names = {
+            language.upper(): language for language in self.configuration
+        }
+        self.lists_pages = {
+            "languages":
+                pages.paginate(
+                    "```Markdown\nAvailable languages\n"
+                    "===================\n\n", [
+                        "[" + str(i + 1) + "](" + language + ")\n"
+                        for i, language in enumerate(sorted(
+                            self.configuration))
+                    ]),
+            "identifiers":
+                pages.paginate(
+                    "```Markdown\nLanguages identifiers\n"
+                    "=====================\n\n", [
+                        "- " + language + (" " * (18 - len(language))) +
+                        "--> " + " / ".join(identifiers) + "\n" for language,
+                        identifiers in self.languages_identifiers.items()
+                    ]),
+            "extensions":
+                pages.paginate(
+                    "```Markdown\nLanguages files extensions"
+                    "\n=====================\n\n", [
+                        "- " + language + (" " * (18 - len(language))) +
+                        "--> ." + " / .".join(extensions) + "\n" for language,
+                        extensions in self.languages_files_extensions.items()
+                    ]),
+            "main_file_names":
+                pages.paginate(
+                    "```Markdown\nMain files names\n"
+                    "=====================\n\n", [
+                        "- " + language + (" " * (18 - len(language))) +
+                        "--> prog" + ("." if extensions[0] != "" else "") +
+                        extensions[0] + "\n" for language, extensions in
+                        self.languages_files_extensions.items()
+                    ])
+        }
+        self.engines_pages = {
+            language.upper(): self.render_engines(language)
+            for language in self.configuration
+        }
+
+    def render_engines(self, language: str):
+        """Renders the pages of the list_engines command for a language"""
+        lines = []
+        i = 1
+        nb_templates = len(self.configuration[language])
+        for template in self.configuration[language]:
+            # In case there are several templates,
+            # group the different engines in them
+            if nb_templates != 1:
+                lines.append("<" + template + ">\n")
+            for engine in self.configuration[language][template]:
+                lines.append("[" + str(i) + "](" + engine + ")\n")
+                i += 1
+            if nb_templates != 1:
+                lines.append("\n")
+        return pages.paginate(
+            "```Markdown\nAvailable engines\n=================\n\n", lines)
+
+    def find_engine(self, language: str, engine_name: str):
+        """Finds an engine of a language from its name or its index (see
+        the list_engines command), returns its template and its name"""
+        engine_name = engine_name.lower()
+        try:
+            engine_index = int(engine_name)
+            i = 0
+            if engine_index >= 1:
+                for engine_template in self.configuration[language]:
+                    nb_engines = len(self.configuration[language]
+                                     [engine_template])
+                    if engine_index > nb_engines + i:
+                        i += nb_engines
+                    else:
+                        return engine_template, list(
+                            self.configuration[language]
+                            [engine_template])[engine_index - i - 1]
+        except ValueError:
+            for engine_template in self.configuration[language]:
+                if engine_name in self.configuration[language][
+                        engine_template]:
+                    return engine_template, engine_name
+        return None, None
+
+    def get_incorrect_engine_message(self, language: str, engine_name: str):
+        return ("`" + engine_name + "` is not a correct engine for " +
+                language + " / isn't available for the bot.\nTo "
+                "list all the available engine for " + language +
+                ", please use `" + self.bot.prefix + "list_engines " +
+                language + "`")
 
     async def get_fetch(self, url):
-        async with async_timeout.timeout(15):
-            async with self.bot.session.get(url) as response:
-                return await response.json()
+        with self.measure_upstream("wandbox", url[url.rfind("/") + 1:]) \
+                as upstream_request:
+            async with async_timeout.timeout(15):
+                async with self.bot.session.get(url) as response:
+                    upstream_request["status"] = response.status
+                    return await response.json()
 
     async def post_fetch(self, url, data=None):
-        async with async_timeout.timeout(15):
-            async with self.bot.session.post(
-                    url,
-                    data=json.dumps(data),
-                    headers={"content-type": "text/javascript"}) as response:
-                return await response.json()
+        with self.measure_upstream("wandbox", url[url.rfind("/") + 1:]) \
+                as upstream_request:
+            async with async_timeout.timeout(15):
+                async with self.bot.session.post(
+                        url,
+                        data=json.dumps(data),
+                        headers={"content-type": "text/javascript"
+                                }) as response:
+                    upstream_request["status"] = response.status
+                    return await response.json()
 
     async def get_paste(self, url):
-        async with async_timeout.timeout(15):
-            async with self.bot.session.get(url) as response:
-                result = await response.text()
-                language = None
-                code = None
-                if not url.startswith("https://pastebin.com/raw/"):
-                    language_begin = result.find("<a href=\"/archive/")
-                    language_begin = result[language_begin:].find(
-                        "margin:0\">") + language_begin
-                    language_end = result[language_begin:].find(
-                        "</a>") + language_begin
-                    language = result[language_begin +
-                                      len("margin:0\">"):language_end]
-                    delimiter = url.rfind("/")
-                    url = url[:delimiter] + "/raw" + url[delimiter:]
-                    async with self.bot.session.get(url) as response:
-                        code = await response.text()
-                else:
-                    code = result
-                return (code, language)
-
-    async def add_long_field(self, embed: discord.Embed, parameter_name: str,
-                             result: dict, field_name: str):
-        """Adds a long field to the embed. Link a pastebin in case the
-        field value is too long"""
-        if parameter_name in result:
-            if len(result[parameter_name])\
-                    > 1022 or result[parameter_name].count("\n") > 20:
-                url = await self.create_pastebin(field_name,
-                                                 result[parameter_name])
-                delimiter = url.rfind("/")
-                url = url[:delimiter] + "/raw" + url[delimiter:]
-                embed.add_field(name=field_name,
-                                value=":page_facing_up: [" + field_name +
-                                ".txt](" + url + ")",
-                                inline=False)
+        """Gets a paste, returns its code and its language"""
+        paste = self.pastes.get(url)
+        self.cache_requests.inc(cache="pastes",
+                                result="hit" if paste else "miss")
+        if not paste:
+            # Concurrent requests of a same paste share its fetch
+            if url not in self.pastes_fetches:
+                fetch = self.bot.loop.create_task(self.load_paste(url))
+                fetch.add_done_callback(
+                    lambda _: self.pastes_fetches.pop(url, None))
+                self.pastes_fetches[url] = fetch
+            paste = await asyncio.shield(self.pastes_fetches[url])
+            self.pastes[url] = paste
+        return paste
+
+    async def load_paste(self, url):
+        """Gets a paste from the shared cache, or from pastebin"""
+        if self.shared_cache:
+            paste = await self.shared_cache.get_async("pastes", url)
+            self.cache_requests.inc(cache="shared_pastes",
+                                    result="hit" if paste else "miss")
+            if paste:
+                return tuple(paste)
+        paste = await self.fetch_paste(url)
+        if self.shared_cache:
+            await self.shared_cache.set_async("pastes", url, paste,
+                                              self.shared_cache_ttl)
+        return paste
+
+    async def fetch_paste(self, url):
+        with self.measure_upstream("pastebin", "get") as upstream_request:
+            async with async_timeout.timeout(15):
+                async with self.bot.session.get(url) as response:
+                    upstream_request["status"] = response.status
+                    result = await response.text()
+                    language = None
+                    code = None
+                    if not url.startswith(self.pastebin_url + "raw/"):
+                        language_begin = result.find("<a href=\"/archive/")
+                        language_begin = result[language_begin:].find(
+                            "margin:0\">") + language_begin
+                        language_end = result[language_begin:].find(
+                            "</a>") + language_begin
+                        language = result[language_begin +
+                                          len("margin:0\">"):language_end]
+                        delimiter = url.rfind("/")
+                        url = url[:delimiter] + "/raw" + url[delimiter:]
+                        async with self.bot.session.get(url) as response:
+                            code = await response.text()
+                    else:
+                        code = result
+                    return (code, language)
+
+    def pack_history_entry(self, run: dict):
+        """Returns a compact representation of a run, for the histories"""
+        return (run["language"], run["template"], run["output_only"],
+                zlib.compress(json.dumps(run["request"]).encode("utf-8")))
+
+    def unpack_history_entry(self, entry: tuple):
+        """Returns the language, the template, the output mode and the
+        request of a packed run"""
+        return entry[:3] + (json.loads(zlib.decompress(entry[3])),)
+
+    async def get_history(self, user_id: int):
+        """Gets the history of an user, loads it from the disk (in the
+        default executor) if needed"""
+        history = self.histories.get(user_id)
+        if history is None:
+            # Its last save must be done before it's loaded again
+            if user_id in self.histories_saves:
+                await asyncio.shield(self.histories_saves[user_id])
+            entries = await self.bot.loop.run_in_executor(
+                None, self.load_history, user_id)
+            # It may have been loaded by another command meanwhile
+            history = self.histories.get(user_id)
+            if history is None:
+                history = deque(entries, maxlen=self.history_size)
+                self.histories[user_id] = history
+        return history
+
+    def load_history(self, user_id: int):
+        """Loads the history of an user from the disk"""
+        file_path = self.histories_folder_path + str(user_id) + ".json"
+        if not os.path.exists(file_path):
+            return []
+        return [
+            tuple(entry[:3]) + (base64.b64decode(entry[3]),)
+            for entry in utils.load_json(file_path)
+        ]
+
+    def evict_history(self, user_id: int, history: deque):
+        """Saves the history of an user evicted from the cache, in the
+        default executor"""
+        save = self.bot.loop.run_in_executor(None, self.save_history,
+                                             user_id, list(history))
+        self.histories_saves[user_id] = save
+        save.add_done_callback(
+            lambda _: self.histories_saves.pop(user_id, None))
+
+    def save_history(self, user_id: int, history: list):
+        """Saves the history of an user on the disk"""
+        if not os.path.isdir(self.histories_folder_path):
+            os.makedirs(self.histories_folder_path)
+        utils.save_json(
+            [
+                list(entry[:3]) + [base64.b64encode(entry[3]).decode("ascii")]
+                for entry in history
+            ], self.histories_folder_path + str(user_id) + ".json")
+
+    async def flush(self):
+        """Saves the state of the module before the bot shuts down"""
+        if self.histories_saves:
+            await asyncio.wait(list(self.histories_saves.values()))
+        for user_id, history in list(self.histories.items()):
+            # The runs finishing meanwhile can modify the history
+            await self.bot.loop.run_in_executor(None, self.save_history,
+                                                user_id, list(history))
+
+    async def add_to_history(self, run: dict):
+        """Adds a run to the history of its author"""
+        history = await self.get_history(run["author"])
+        entry = self.pack_history_entry(run)
+        if not history or history[-1] != entry:
+            history.append(entry)
+
+    def start_run(self, ctx, request: dict, language: str, template: str,
+                  output_only: bool):
+        """Starts the execution of a request on wandbox, returns the run"""
+        self.last_run_id += 1
+        run = {
+            "id": self.last_run_id,
+            "author": ctx.message.author.id,
+            "message": ctx.message.id,
+            "content": ctx.message.content,
+            "request": request,
+            "language": language,
+            "template": template,
+            "output_only": output_only,
+            "result_message": None,
+            "finished_at": None,
+            "permalink": None,
+            "cancelled": False,
+            "task": self.bot.loop.create_task(self.execute(ctx, request))
+        }
+        self.runs[run["id"]] = run
+        return run
+
+    async def execute(self, ctx, request: dict):
+        """Executes a request on wandbox (in a worker process if they are
+        enabled), returns its result. The results of the requests executed
+        by any process are in the shared cache, if enabled"""
+        with tracing.span(ctx, "compile",
+                          compiler=request["compiler"]) as compile_span:
+            if self.shared_cache:
+                key = hashlib.sha256(
+                    json.dumps(request,
+                               sort_keys=True).encode("utf-8")).hexdigest()
+                result = await self.shared_cache.get_async("results", key)
+                self.cache_requests.inc(cache="shared_results",
+                                        result="hit" if result else "miss")
+                if result:
+                    compile_span.attributes["cached"] = True
+                    return result
+            if not self.workers:
+                result = await self.post_fetch(
+                    self.wandbox_url + "compile.json", request)
             else:
-                embed.add_field(name=field_name,
-                                value="`" + result[parameter_name] + "`",
-                                inline=False)
+                result = await self.workers.run(
+                    workers.execute,
+                    self.wandbox_url,
+                    request,
+                    record=functools.partial(self.record_worker_requests,
+                                             ctx))
+            # Killed programs may succeed another time
+            if self.shared_cache and "status" in result \
+                    and "signal" not in result:
+                await self.shared_cache.set_async("results", key, result,
+                                                  self.shared_cache_ttl)
+            return result
+
+    async def get_run_result(self, run: dict, on_slow=None):
+        """Waits for a run to be done, returns its result. The coroutine
+        function `on_slow` is awaited if it isn't done after
+        self.run_status_delay seconds"""
+        try:
+            if on_slow:
+                await asyncio.wait({run["task"]},
+                                   timeout=self.run_status_delay)
+                if not run["task"].done():
+                    await on_slow()
+            return await run["task"]
+        finally:
+            # Its command may have been cancelled before it was awaited
+            if not run["task"].done():
+                run["task"].cancel()
+            del self.runs[run["id"]]
+            if not run["cancelled"]:
+                run["finished_at"] = time.monotonic()
+                self.finished_runs[run["id"]] = run
+                self.messages_runs[run["message"]] = run["id"]
+
+    async def wait_run(self, ctx, run: dict):
+        """Waits for a run to be done, returns its result or None if it has
+        been cancelled. The ID of a long run is shown in a status message
+        (see send_run_status), which then shows its result"""
+        try:
+            async with ctx.typing():
+                return await self.get_run_result(
+                    run, functools.partial(self.send_run_status, ctx, run))
+        except asyncio.CancelledError:
+            # The command itself may have been cancelled
+            if not run["cancelled"]:
+                raise
+            content = "Run #" + str(run["id"]) + " cancelled."
+            if run["result_message"]:
+                await run["result_message"].edit(content=content, embed=None)
+            else:
+                await ctx.channel.send(content)
+            return None
+
+    async def send_run_status(self, ctx, run: dict):
+        """Sends the status message of a run in progress, telling how to
+        cancel it"""
+        await self.send_result(
+            ctx, [run], "Run #" + str(run["id"]) + " in progress, `" +
+            ctx.prefix + "cancel " + str(run["id"]) +
+            "` or react with \u274c on your message to cancel it.")
+
+    def cancel_run(self, run: dict):
+        """Cancels a run and the other runs triggered by the same message,
+        their pending wandbox requests are aborted"""
+        for message_run in list(self.runs.values()):
+            if message_run["message"] == run["message"]:
+                message_run["cancelled"] = True
+                message_run["task"].cancel()
+
+    def can_cancel_run(self, run: dict, user_id: int):
+        """Checks if an user is allowed to cancel a run"""
+        return user_id in (run["author"], self.bot.owner_id,
+                           self.bot.config_owner_id)
+
+    def set_result_message(self, run: dict, message: discord.Message):
+        """Sets the message showing the result of a run"""
+        run["result_message"] = message
+        self.messages_runs[message.id] = run["id"]
+
+    async def send_run_result(self, ctx, run: dict, result: dict):
+        """Sends the result of a run. If the run has been triggered by an
+        edit, the previous result message is edited instead"""
+        request = run["request"]
+        job = self.create_render_job(
+            ctx, run["language"], run["template"], request["compiler"],
+            request["compiler-option-raw"] + request["runtime-option-raw"],
+            result, run["id"])
+        job["output_only"] = run["output_only"]
+        with tracing.span(ctx, "render", worker=bool(self.workers)):
+            if self.workers:
+                content, embed = await self.workers.run(
+                    workers.render,
+                    job,
+                    record=functools.partial(self.record_worker_requests,
+                                             ctx))
+                if embed:
+                    embed = discord.Embed.from_dict(embed)
+            else:
+                content, embed = await rendering.render_run_result(
+                    job, functools.partial(self.upload_output, ctx))
+        await self.send_result(ctx, [run], content, embed)
+
+    async def send_result(self, ctx, runs: list, content: str = None,
+                          embed: discord.Embed = None,
+                          file: discord.File = None):
+        """Sends the result of some runs. Their status message, or if they
+        have been triggered by an edit the previous result message, is
+        edited instead (except for files, which can't be edited)"""
+        message = None
+        previous_run = getattr(ctx, "previous_run", None)
+        if not file:
+            message = runs[0]["result_message"] if runs else None
+            if not message and previous_run:
+                message = previous_run["result_message"]
+        if message:
+            try:
+                with tracing.span(ctx, "send", edit=True):
+                    await message.edit(content=content, embed=embed)
+            except discord.NotFound:
+                message = None
+        if not message:
+            with tracing.span(ctx, "send"):
+                message = await ctx.channel.send(content=content,
+                                                 embed=embed,
+                                                 file=file)
+        for run in runs:
+            self.set_result_message(run, message)
+
+    async def run_concurrently(self,
+                               ctx,
+                               requests: list,
+                               language: str,
+                               stop=None):
+        """Runs several requests (list of (template, request)), at most
+        self.runs_concurrency at the same time.
+        `stop` is called with the index and the result of each run, the
+        remaining runs are skipped once it returns True.
+        Returns the runs, the results (None for skipped runs) and whether
+        the runs have been cancelled by the user"""
+        semaphore = asyncio.Semaphore(self.runs_concurrency)
+        runs = []
+        state = {"stopped": False}
+
+        async def run_request(index: int, template: str, request: dict):
+            async with semaphore:
+                if state["stopped"] or any(run["cancelled"] for run in runs):
+                    return None
+                run = self.start_run(ctx, request, language, template, False)
+                runs.append(run)
+                try:
+                    result = await self.get_run_result(run)
+                except asyncio.CancelledError:
+                    if not run["cancelled"]:
+                        raise
+                    return None
+                except (asyncio.TimeoutError, aiohttp.ClientError):
+                    result = {"signal": "Couldn't reach wandbox"}
+            if stop and not state["stopped"] and stop(index, result):
+                state["stopped"] = True
+                for other_run in runs:
+                    if not other_run["task"].done():
+                        other_run["cancelled"] = True
+                        other_run["task"].cancel()
+            return result
+
+        async with ctx.typing():
+            results = await asyncio.gather(*[
+                run_request(i, template, request)
+                for i, (template, request) in enumerate(requests)
+            ])
+        cancelled = not state["stopped"] and any(
+            run["cancelled"] for run in runs)
+        return runs, results, cancelled
+
+    async def run_matrix(self, ctx, request: dict, language: str,
+                         engines: list):
+        """Runs a request with several engines (list of (template, engine)),
+        the results are grouped by identical outputs"""
+        requests = []
+        for template, engine in engines:
+            engine_request = dict(request)
+            engine_request["compiler"] = engine
+            engine_info = self.configuration[language][template][engine]
+            if not engine_info.compiler_option_raw:
+                engine_request["compiler-option-raw"] = ""
+            if not engine_info.runtime_option_raw:
+                engine_request["runtime-option-raw"] = ""
+            requests.append((template, engine_request))
+        runs, results, cancelled = await self.run_concurrently(
+            ctx, requests, language)
+        if cancelled:
+            await ctx.channel.send("Matrix cancelled.")
+            return
+
+        render_span = tracing.span(ctx, "render")
+        groups = {}
+        for (_, engine), result in zip(engines, results):
+            key = tuple(
+                result.get(field, "")
+                for field in ("status", "signal", "compiler_output",
+                              "compiler_error", "program_output",
+                              "program_error"))
+            if key not in groups:
+                groups[key] = ([], result)
+            groups[key][0].append(engine)
+
+        summary = str(len(engines)) + " engine" + \
+            ("s, " if len(engines) > 1 else ", ") + str(len(groups)) + \
+            " different result" + ("s" if len(groups) > 1 else "")
+        fields = []
+        for group_engines, result in groups.values():
+            fields.append((", ".join(group_engines),
+                           self.format_matrix_result(result)))
+        if len(fields) > 25 or sum(
+                len(name) + len(value) for name, value in fields) > 5000:
+            report = "\n\n".join(name + "\n" + "-" * len(name) + "\n" + value
+                                  for name, value in fields)
+            render_span.end()
+            await self.send_result(
+                ctx,
+                runs,
+                content=summary + ".",
+                file=discord.File(io.BytesIO(report.encode("utf-8")),
+                                  "results.txt"))
+            return
 
-    async def create_embed_result(self, ctx, language: str, template_used: str,
-                                  engine_used: str, command_options: str,
-                                  info: dict):
-        # Returns an embed corresponding to the Wandbox comile result passed
-        # field amount = 25, title/field name = 256, value = 1024, footer
-        # text/description = 2048 Note that the sum of all characters
-        # in the embed should be less than or equal to 6000.
         embed = discord.Embed()
         embed.title = "Results"
-        embed.url = info["url"]
-        timestamp = ctx.message.created_at
-        timestamp += -1 * get_localzone().utcoffset(timestamp)
-        embed.timestamp = timestamp
-        embed.add_field(name="Engine used", value=engine_used, inline=True)
-        embed.add_field(name="Command used",
-                        value=self.configuration[language][template_used]
-                        [engine_used]["display-compile-command"] + " " +
-                        command_options,
-                        inline=True)
-        if "compiler_error" in info or "program_error" in info:
-            if "status" not in info or info["status"] != '0':
-                embed.colour = discord.Color.red()
-            else:
-                embed.colour = discord.Color.orange()
-        elif "signal" in info:
+        embed.description = summary
+        if len(groups) == 1 and results[0].get("status") == "0" \
+                and "compiler_error" not in results[0] \
+                and "program_error" not in results[0]:
+            embed.colour = discord.Color.green()
+        elif len(groups) == 1:
             embed.colour = discord.Color.red()
-        elif info["status"] != '0':
+        else:
             embed.colour = discord.Color.orange()
+        self.set_embed_infos(ctx, embed, language, "Matrix")
+        for name, value in fields:
+            if len(name) > 256:
+                name = name[:253] + "..."
+            if len(value) > 1024:
+                value = value[:1017] + "...```"
+            embed.add_field(name=name, value=value, inline=False)
+        render_span.end()
+        await self.send_result(ctx, runs, embed=embed)
+
+    def parse_tests(self, tests: str):
+        """Parses test cases, returns a list of (input, expected output).
+        Cases are separated by a line "===", the input and the expected
+        output of a case are separated by a line "---" """
+        cases = []
+        case = [[]]
+        for line in tests.split("\n"):
+            if line.strip() == "===":
+                cases.append(case)
+                case = [[]]
+            elif line.strip() == "---" and len(case) == 1:
+                case.append([])
+            else:
+                case[-1].append(line)
+        cases.append(case)
+        if any(len(case) != 2 for case in cases):
+            return None
+        return [("\n".join(case_input), "\n".join(expected))
+                for case_input, expected in cases]
+
+    def normalize_output(self, output: str):
+        """Normalizes an output before comparing it (trailing spaces and
+        trailing empty lines are ignored)"""
+        return "\n".join(line.rstrip()
+                         for line in output.rstrip().split("\n"))
+
+    async def run_tests(self, ctx, request: dict, language: str,
+                        template: str, cases: list, max_failures: int):
+        """Runs a request for each test case (list of (input, expected
+        output)), stops once max_failures cases failed (if not 0) and sends
+        a pass / fail table"""
+        failures = []
+
+        def is_passed(result: dict, expected: str):
+            return result.get("status") == "0" and "signal" not in result \
+                and self.normalize_output(result.get(
+                    "program_output", "")) == self.normalize_output(expected)
+
+        def stop(index: int, result: dict):
+            if not is_passed(result, cases[index][1]):
+                failures.append(index)
+            return max_failures and len(failures) >= max_failures
+
+        requests = []
+        for case_input, _ in cases:
+            case_request = dict(request)
+            case_request["stdin"] = case_input
+            requests.append((template, case_request))
+
+        runs, results, cancelled = await self.run_concurrently(
+            ctx, requests, language, stop)
+        if cancelled:
+            await ctx.channel.send("Tests cancelled.")
+            return
+
+        render_span = tracing.span(ctx, "render")
+        table = "  #  Result  Status\n"
+        nb_passed = 0
+        first_failure = None
+        for i, ((_, expected), result) in enumerate(zip(cases, results)):
+            if result is None:
+                verdict = "SKIP"
+            elif is_passed(result, expected):
+                verdict = "PASS"
+                nb_passed += 1
+            else:
+                verdict = "FAIL"
+                if first_failure is None:
+                    first_failure = (i, expected, result)
+            status = "" if result is None else result.get(
+                "status", result.get("signal", ""))
+            table += str(i + 1).rjust(3) + "  " + verdict.ljust(6) + "  " + \
+                status + "\n"
+        msg = str(nb_passed) + "/" + str(len(cases)) + " tests passed.\n"
+        msg += "```\n" + table + "```"
+        if first_failure:
+            i, expected, result = first_failure
+            output = result.get("program_output", "") + \
+                result.get("compiler_error", "") + \
+                result.get("program_error", "")
+            msg += "Test " + str(i + 1) + ":\nExpected:```\n" + \
+                expected[:300] + "```Got:```\n" + output[:300] + "```"
+        render_span.end()
+        if len(msg) > 2000:
+            await self.send_result(ctx,
+                                   runs,
+                                   content=str(nb_passed) + "/" +
+                                   str(len(cases)) + " tests passed.",
+                                   file=discord.File(
+                                       io.BytesIO(table.encode("utf-8")),
+                                       "tests.txt"))
         else:
-            embed.colour = discord.Color.green()
-        embed.set_footer(text="Requested by " + ctx.message.author.name + "#" +
-                         ctx.message.author.discriminator,
-                         icon_url=ctx.message.author.avatar_url)
-        embed.set_thumbnail(url=self.languages_images[language])
-        embed.set_author(name=self.bot.user.name + "#" +
-                         self.bot.user.discriminator,
-                         icon_url=self.bot.user.avatar_url)
-
-        remaining_space = 6000 - \
-            (30 + len(ctx.message.author.name) + len(self.bot.user.name))
-
-        if "status" in info:
-            embed.add_field(name="Exit status",
-                            value=info["status"],
-                            inline=False)
-            remaining_space -= 11 + len(info["status"])
-
-        await self.add_long_field(embed, "signal", info, "Signal")
-        await self.add_long_field(embed, "compiler_output", info,
-                                  "Compiler output")
-        await self.add_long_field(embed, "compiler_error", info,
-                                  "Compiler warnings / errors")
-        await self.add_long_field(embed, "program_output", info, "Output")
-        await self.add_long_field(embed, "program_error", info,
-                                  "Runtime errors")
-
-        return embed
+            await self.send_result(ctx, runs, content=msg)
+
+    def format_matrix_result(self, result: dict):
+        """Formats the result of an engine of a matrix"""
+        msg = ""
+        if "status" in result:
+            msg += "Exit status: " + result["status"] + "\n"
+        if "signal" in result:
+            msg += "Signal: " + result["signal"] + "\n"
+        output = "".join(
+            result.get(field, "")
+            for field in ("compiler_error", "program_output", "program_error"))
+        if output:
+            msg += "```\n" + output.replace("```", "`\u200b``") + "```"
+        return msg
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload):
+        """Runs the code again when the message of a recent run is edited,
+        its result message is then edited"""
+        run = self.finished_runs.get(self.messages_runs.get(payload.message_id))
+        if not run or run["message"] != payload.message_id \
+                or time.monotonic() - run["finished_at"] > self.edit_window:
+            return
+        # The checks of Discode.on_message: its author may have been
+        # blacklisted since the run
+        if run["author"] in self.bot.blacklist:
+            return
+        # Embeds being resolved also trigger this event
+        content = payload.data.get("content")
+        if content is None or content == run["content"]:
+            return
+        message = payload.cached_message
+        if message:
+            message.content = content
+        else:
+            channel = self.bot.get_channel(payload.channel_id)
+            if not channel:
+                return
+            try:
+                message = await channel.fetch_message(payload.message_id)
+            except discord.HTTPException:
+                return
+        if message.author.bot:
+            return
+        ctx = await self.bot.get_context(message)
+        if ctx.command is self.code:
+            ctx.previous_run = run
+            await self.bot.invoke(ctx)
+
+    async def get_permalink(self, run: dict):
+        """Gets the permalink of a run, executing its request again with
+        saving enabled the first time"""
+        if not run["permalink"]:
+            request = dict(run["request"])
+            request["save"] = True
+            run["permalink"] = self.bot.loop.create_task(
+                self.post_fetch(self.wandbox_url + "compile.json",
+                                request))
+        try:
+            result = await run["permalink"]
+        except Exception:
+            run["permalink"] = None
+            raise
+        # e.g. a compilation error, it can be tried again
+        if not result.get("url"):
+            run["permalink"] = None
+        return result.get("url")
+
+    async def send_permalink(self, channel, run: dict):
+        """Sends the permalink of a run and adds it to its result embed"""
+        async with channel.typing():
+            url = await self.get_permalink(run)
+        if not url:
+            await channel.send("Couldn't create the permalink of run #" +
+                               str(run["id"]) + ".")
+            return
+        message = run["result_message"]
+        if message and message.embeds and message.embeds[0].url != url:
+            embed = message.embeds[0]
+            embed.url = url
+            await message.edit(embed=embed)
+        await channel.send("Permalink of run #" + str(run["id"]) + ": <" +
+                           url + ">")
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload):
+        """Cancels a run when its author reacts with \u274c on the message
+        which triggered it, creates its permalink on \U0001f517. Turns the
+        pages of the lists"""
+        if payload.emoji.name in (pages.PREVIOUS_PAGE, pages.NEXT_PAGE):
+            await self.paged_messages.turn_page(self.bot, payload)
+        elif payload.emoji.name == "\u274c":
+            for run in self.runs.values():
+                if run["message"] == payload.message_id:
+                    if self.can_cancel_run(run, payload.user_id):
+                        self.cancel_run(run)
+                    return
+        elif payload.emoji.name == "\U0001f517" and \
+                payload.user_id != self.bot.user.id:
+            run = self.finished_runs.get(
+                self.messages_runs.get(payload.message_id))
+            channel = self.bot.get_channel(payload.channel_id)
+            if run and channel:
+                await self.send_permalink(channel, run)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_remove(self, payload):
+        """Turns the pages of the lists too"""
+        await self.paged_messages.turn_page(self.bot, payload)
+
+    def get_embed_infos(self, ctx, language: str, footer_suffix: str = ""):
+        """Returns the timestamp, the footer, the thumbnail and the author of
+        a result embed"""
+        # Imported on first use, it's slow to import
+        from tzlocal import get_localzone
+        timestamp = ctx.message.created_at
+        timestamp += -1 * get_localzone().utcoffset(timestamp)
+        return {
+            "timestamp": timestamp,
+            "footer": "Requested by " + ctx.message.author.name + "#" +
+                      ctx.message.author.discriminator +
+                      (" - " + footer_suffix if footer_suffix else ""),
+            "footer_icon": str(ctx.message.author.avatar_url),
+            "thumbnail": self.languages_images[language],
+            "author": self.bot.user.name + "#" + self.bot.user.discriminator,
+            "author_icon": str(self.bot.user.avatar_url)
+        }
+
+    def set_embed_infos(self, ctx, embed: discord.Embed, language: str,
+                        footer_suffix: str = ""):
+        """Sets the timestamp, the footer, the thumbnail and the author of a
+        result embed"""
+        rendering.set_embed_infos(
+            embed, self.get_embed_infos(ctx, language, footer_suffix))
+
+    def create_render_job(self, ctx, language: str, template_used: str,
+                          engine_used: str, command_options: str, info: dict,
+                          run_id: int = 0):
+        """Returns what's needed to render the result of a run, without
+        the bot (see modules/utils/rendering.py)"""
+        return {
+            "result": info,
+            "output_only": False,
+            "engine": engine_used,
+            "command": self.configuration[language][template_used]
+                       [engine_used].display_compile_command + " " +
+                       command_options,
+            "infos": self.get_embed_infos(
+                ctx, language, "Run #" + str(run_id) if run_id else ""),
+            "pastebin_url": self.pastebin_url,
+            "pastebin_api_key": self.pastebin_api_key
+        }
+
+    async def create_embed_result(self, ctx, language: str, template_used: str,
+                                  engine_used: str, command_options: str,
+                                  info: dict, run_id: int = 0):
+        """Returns an embed corresponding to the Wandbox compile result"""
+        return await rendering.create_embed_result(
+            self.create_render_job(ctx, language, template_used, engine_used,
+                                   command_options, info, run_id),
+            functools.partial(self.upload_output, ctx))
 
     @commands.command()
     async def code(self, ctx, *, code):
@@ -294,6 +1152,16 @@ class Code(commands.Cog):
         You can add the "output_only" parameter to only get the output
         result of the code (only if the code has no errors).
 
+        If you want to compare the results of several engines, you can list
+        them with the "engines" parameter (or use "engines all" for all the
+        engines of your language). Identical results are grouped together.
+
+        You can check your code against several test cases with the "tests"
+        parameter. Each case is composed of its input and its expected
+        output, separated by a line "---". Cases are separated by a line
+        "===". The "max_failures" parameter stops the tests once this number
+        of cases failed.
+
         The values of the parameters "code" and "input" must be surrounded
         by the character `.
 
@@ -304,6 +1172,7 @@ class Code(commands.Cog):
         https://github.com/Beafantles/Discode#how-to-use-the-bot
         https://www.youtube.com/watch?v=6CVZJft65RI
         """
+        parse_span = tracing.span(ctx, "parse")
         lines = code.split("\n")
         parameters = {}
         has_verbose_code = False
@@ -356,19 +1225,21 @@ class Code(commands.Cog):
                 parameter_name = line
             if parameter_name not in [
                     "engine", "code", "compiler-options", "runtime-options",
-                    "input", "language", "output_only"
+                    "input", "language", "output_only", "engines", "tests",
+                    "max_failures"
             ]:
                 await ctx.channel.send(
                     "Invalid parameter `" + parameter_name +
                     "`.\nCheck out available parameters by typing `" +
                     self.bot.prefix + "help code`.\nIgnoring this parameter.")
             else:
-                if parameter_name == "input":
+                if parameter_name in ("input", "tests"):
                     begin = line.find("`")
                     if begin == -1:
                         await ctx.channel.send(
-                            "Invalid input parameter format.\nCheck "
-                            "out input format by typing `" + self.bot.prefix +
+                            "Invalid " + parameter_name +
+                            " parameter format.\nCheck out " + parameter_name +
+                            " format by typing `" + self.bot.prefix +
                             "help code`.")
                         return
                     parameter_value = ""
@@ -387,8 +1258,9 @@ class Code(commands.Cog):
                             line = lines[i]
                     if not found:
                         await ctx.channel.send(
-                            "Invalid input parameter format.\nCheck out "
-                            "input format by typing `" + self.bot.prefix +
+                            "Invalid " + parameter_name +
+                            " parameter format.\nCheck out " + parameter_name +
+                            " format by typing `" + self.bot.prefix +
                             "help code`.")
                         return
                 elif parameter_name == "output_only":
@@ -427,14 +1299,15 @@ class Code(commands.Cog):
                     first_code = None
                     for line in parameter_value:
                         if first:
-                            if not line.startswith("https://pastebin.com/"):
+                            if not line.startswith(self.pastebin_url):
                                 await ctx.channel.send(
                                     "Incorrect link for the first file.\n"
                                     "The link must be an url from pastebin.")
                                 return
                             else:
                                 url = line
-                            result = await self.get_paste(url)
+                            with tracing.span(ctx, "paste"):
+                                result = await self.get_paste(url)
                             first_code = result[0]
                             if result[1] and result[1] in self.configuration:
                                 supposed_languages[result[1]] = 1
@@ -450,13 +1323,14 @@ class Code(commands.Cog):
                         file_name = line[:delimiter]
                         file_link = line[delimiter + 1:]
                         file_code = None
-                        if not file_link.startswith("https://pastebin.com/"):
+                        if not file_link.startswith(self.pastebin_url):
                             await ctx.channel.send(
                                 "Incorrect link for the file `" + file_name +
                                 "`.\nThe link must be an url from pastebin.")
                             return
                         url = file_link
-                        result = await self.get_paste(url)
+                        with tracing.span(ctx, "paste"):
+                            result = await self.get_paste(url)
                         file_code = result[0]
                         if result[1]:
                             if result[1] in supposed_languages:
@@ -496,12 +1370,11 @@ class Code(commands.Cog):
                             "help code`.")
                         return
                     language_name = line[delimiter + 1:]
-                    correct_language = False
-                    for language in self.configuration:
-                        if language.upper() == language_name.upper():
-                            correct_language = True
-                            code_language = language
-                            break
+                    correct_language = language_name.upper() \
+                        in self.languages_names
+                    if correct_language:
+                        code_language = self.languages_names[
+                            language_name.upper()]
                     if not correct_language:
                         await ctx.channel.send(
                             "`" + language_name +
@@ -537,46 +1410,61 @@ class Code(commands.Cog):
                     "specify it explicity, please use `language` "
                     "parameter.\nCheck out `" + self.bot.prefix +
                     "help code` for more info.")
-        engine_template_used = None
-        if "engine" in parameters:
-            correct_engine = False
-            parameters["engine"] = parameters["engine"].lower()
-            try:
-                engine_index = int(parameters["engine"])
-                i = 0
-                if engine_index >= 1:
-                    for engine_template in self.configuration[code_language]:
-                        nb_engines = len(
-                            self.configuration[code_language][engine_template])
-                        if engine_index > nb_engines + i:
-                            i += nb_engines
-                        else:
-                            engine_template_used = engine_template
-                            parameters["engine"] = list(
-                                self.configuration[code_language]
-                                [engine_template])[engine_index - i - 1]
-                            correct_engine = True
-                            break
-            except ValueError:
+        test_cases = []
+        max_failures = 0
+        if "tests" in parameters:
+            if "engines" in parameters or "input" in parameters:
+                await ctx.channel.send(
+                    "The `tests` parameter can't be used with `engines` "
+                    "nor `input` parameters.")
+                return
+            test_cases = self.parse_tests(parameters["tests"])
+            if not test_cases:
+                await ctx.channel.send(
+                    "Invalid tests parameter format.\nCheck out tests "
+                    "format by typing `" + self.bot.prefix + "help code`.")
+                return
+            if "max_failures" in parameters:
+                try:
+                    max_failures = int(parameters["max_failures"])
+                except ValueError:
+                    max_failures = -1
+                if max_failures < 0:
+                    await ctx.channel.send(
+                        "`max_failures` must be a positive number.")
+                    return
+        matrix_engines = []
+        if "engines" in parameters:
+            if "engine" in parameters:
+                await ctx.channel.send(
+                    "Please use either `engine` or `engines` parameter.")
+                return
+            if parameters["engines"].lower() == "all":
                 for engine_template in self.configuration[code_language]:
                     for engine in self.configuration[code_language][
                             engine_template]:
-                        if parameters["engine"] == engine:
-                            correct_engine = True
-                            engine_template_used = engine_template
-                            break
-                    if correct_engine:
-                        break
-            if not correct_engine:
-                await ctx.channel.send("`" + parameters["engine"] +
-                                       "` is not a correct engine for " +
-                                       code_language +
-                                       " / isn't available for the bot.\nTo "
-                                       "list all the available engine for " +
-                                       code_language + ", please use `" +
-                                       self.bot.prefix + "list_engines " +
-                                       code_language + "`")
+                        matrix_engines.append((engine_template, engine))
+            else:
+                for engine_name in parameters["engines"].split():
+                    engine_template, engine = self.find_engine(
+                        code_language, engine_name)
+                    if not engine:
+                        await ctx.channel.send(
+                            self.get_incorrect_engine_message(
+                                code_language, engine_name))
+                        return
+                    if (engine_template, engine) not in matrix_engines:
+                        matrix_engines.append((engine_template, engine))
+        engine_template_used = None
+        if "engine" in parameters:
+            engine_template_used, engine = self.find_engine(
+                code_language, parameters["engine"])
+            if not engine:
+                await ctx.channel.send(
+                    self.get_incorrect_engine_message(code_language,
+                                                      parameters["engine"]))
                 return
+            parameters["engine"] = engine
         else:
             if ctx.message.author.id in self.users_configuration \
                 and "engines" in self.users_configuration[
@@ -590,16 +1478,18 @@ class Code(commands.Cog):
             else:
                 engine_template_used = self.default_engines[code_language][0]
                 parameters["engine"] = self.default_engines[code_language][1]
-        if "compiler-options" in parameters and not self.configuration[
+        if "compiler-options" in parameters and not matrix_engines \
+                and not self.configuration[
                 code_language][engine_template_used][
-                    parameters["engine"]]["compiler-option-raw"]:
+                    parameters["engine"]].compiler_option_raw:
             await ctx.channel.send(
                 "There is no options available for compilation using `" +
                 parameters["engine"] + "`.\nIgnoring these options.")
             del parameters["compiler-options"]
-        if "runtime-options" in parameters and not self.configuration[
+        if "runtime-options" in parameters and not matrix_engines \
+                and not self.configuration[
                 code_language][engine_template_used][
-                    parameters["engine"]]["runtime-option-raw"]:
+                    parameters["engine"]].runtime_option_raw:
             await ctx.channel.send(
                 "There is no options available for runtime execution using `" +
                 parameters["engine"] + "`.\nIgnoring these options.")
@@ -637,66 +1527,144 @@ class Code(commands.Cog):
             "code": parameters["code"],
             "codes": parameters["codes"] if "codes" in parameters else [],
             "compiler": parameters["engine"],
-            "save": True,
+            # Permalinks are created on demand, see get_permalink
+            "save": False,
             "stdin": parameters["input"] if "input" in parameters else "",
             "compiler-option-raw": parameters["compiler-options"],
             "runtime-option-raw": parameters["runtime-options"]
         }
+        parse_span.end()
 
-        async with ctx.typing():
-            result = await self.post_fetch(
-                "https://wandbox.org/api/compile.json", request)
-
-        if not parameters["output_only"] or "compiler_error" in result \
-                or "program_error" in result:
-            embed = await self.create_embed_result(
-                ctx, code_language, engine_template_used, parameters["engine"],
-                (parameters["compiler-options"]
-                 if "compiler-options" in parameters else "") +
-                (parameters["runtime-options"]
-                 if "runtime-options" in parameters else ""), result)
-            await ctx.channel.send(embed=embed)
+        if matrix_engines:
+            await self.run_matrix(ctx, request, code_language, matrix_engines)
+            return
+        if test_cases:
+            await self.run_tests(ctx, request, code_language,
+                                 engine_template_used, test_cases,
+                                 max_failures)
+            return
+
+        previous_run = getattr(ctx, "previous_run", None)
+        if previous_run and previous_run["request"] == request \
+                and previous_run["output_only"] == parameters["output_only"]:
+            # Nothing changed but the formatting of the message
+            previous_run["content"] = ctx.message.content
+            return
+
+        run = self.start_run(ctx, request, code_language,
+                             engine_template_used, parameters["output_only"])
+        await self.add_to_history(run)
+        result = await self.wait_run(ctx, run)
+        if result is None:
+            return
+        await self.send_run_result(ctx, run, result)
+
+    @commands.command()
+    async def history(self, ctx):
+        """Lists your last runs"""
+        history = await self.get_history(ctx.message.author.id)
+        if not history:
+            await ctx.channel.send("You haven't run any code yet.")
+            return
+        msg = "```Markdown\nLast runs\n=========\n\n"
+        for i, entry in enumerate(reversed(history)):
+            language, _, _, request = self.unpack_history_entry(entry)
+            first_line = request["code"].strip().split("\n")[0]
+            if len(first_line) > 40:
+                first_line = first_line[:37] + "..."
+            msg += "[" + str(i + 1) + "](" + language + " - " + \
+                request["compiler"] + ") " + first_line + "\n"
+        msg += "```\nUse `" + self.bot.prefix + "rerun <number>` to run " \
+            "one of them again."
+        await ctx.channel.send(msg)
+
+    @commands.command()
+    async def rerun(self, ctx, index: int = 1):
+        """Runs again one of your last runs
+        Parameters:
+            index: The number of the run in your history (see the history
+                   command).
+                   Leaving this blank will run your last run again.
+
+        Example: [p]rerun 2"""
+        history = await self.get_history(ctx.message.author.id)
+        if index < 1 or index > len(history):
+            await ctx.channel.send("There is no such run in your history.")
+            return
+        language, template, output_only, request = \
+            self.unpack_history_entry(history[-index])
+        if language not in self.configuration \
+                or template not in self.configuration[language] \
+                or request["compiler"] not in self.configuration[language][
+                    template]:
+            await ctx.channel.send("`" + request["compiler"] +
+                                   "` isn't available anymore.")
+            return
+        run = self.start_run(ctx, request, language, template, output_only)
+        result = await self.wait_run(ctx, run)
+        if result is None:
+            return
+        await self.send_run_result(ctx, run, result)
+
+    @commands.command()
+    async def cancel(self, ctx, run_id: int = 0):
+        """Cancels one of your runs
+        Parameters:
+            run_id: The ID of the run you want to cancel.
+                    Leaving this blank will cancel your last run.
+
+        You can also react with \u274c on the message of your run."""
+        if run_id:
+            run = self.runs.get(run_id)
         else:
-            msg = ""
-            if len(result["program_output"])\
-                    > 1998 or result["program_output"].count('\n') > 20:
-                msg = "Output here: <" + await self.create_pastebin(
-                    "Output", result["program_output"]) + '>'
-            else:
-                msg = '`' + result["program_output"] + '`'
-            await ctx.channel.send(msg)
+            run = None
+            for user_run in self.runs.values():
+                if user_run["author"] == ctx.message.author.id:
+                    run = user_run
+        if not run:
+            await ctx.channel.send("There is no such running code.")
+        elif not self.can_cancel_run(run, ctx.message.author.id):
+            await ctx.channel.send("You can only cancel your own runs.")
+        else:
+            self.cancel_run(run)
+
+    @commands.command()
+    async def permalink(self, ctx, run_id: int = 0):
+        """Creates the permalink of a run
+        Parameters:
+            run_id: The ID of the run (shown in the footer of its result).
+                    Leaving this blank will use your last run.
+
+        You can also react with \U0001f517 on the message of your run or on
+        its result."""
+        if run_id:
+            run = self.finished_runs.get(run_id)
+        else:
+            run = None
+            for user_run in self.finished_runs.values():
+                if user_run["author"] == ctx.message.author.id:
+                    run = user_run
+        if not run:
+            await ctx.channel.send(
+                "There is no such run (or it's too old to be retrieved).")
+        else:
+            await self.send_permalink(ctx.channel, run)
 
     @commands.command()
     async def list_languages(self, ctx):
         """Lists all the available languages for this module"""
-        msg = "```Markdown\nAvailable languages\n===================\n\n"
-        for i, language in enumerate(sorted(self.configuration)):
-            msg += "[" + str(i + 1) + "](" + language + ")\n"
-        msg += "```"
-        await ctx.channel.send(msg)
+        await self.paged_messages.send(ctx.channel,
+                                       self.lists_pages["languages"],
+                                       ctx.message.author.id)
 
     @commands.command()
     async def list_engines(self, ctx, *, language_name):
         """Lists all available compilers / interpreters for a language"""
-        msg = "```Markdown\nAvailable engines\n=================\n\n"
-        language_name = language_name.upper()
-        for language in self.configuration:
-            if language.upper() == language_name:
-                i = 1
-                nb_templates = len(self.configuration[language])
-                for template in self.configuration[language]:
-                    # In case there are several templates,
-                    # group the different engines in them
-                    if nb_templates != 1:
-                        msg += "<" + template + ">\n"
-                    for engine in self.configuration[language][template]:
-                        msg += "[" + str(i) + "](" + engine + ")\n"
-                        i += 1
-                    if nb_templates != 1:
-                        msg += "\n"
-                msg += "```"
-                await ctx.channel.send(msg)
-                return
+        engines_pages = self.engines_pages.get(language_name.upper())
+        if engines_pages:
+            await self.paged_messages.send(ctx.channel, engines_pages,
+                                           ctx.message.author.id)
+            return
         await ctx.channel.send(
             "There is no such available language.\nTo list all the "
             "available languages, please use `" + self.bot.prefix +
@@ -706,49 +1674,47 @@ class Code(commands.Cog):
     async def list_identifiers(self, ctx):
         """Lists all the languages identifiers
         recognized by Discord / the bot"""
-        msg = "```Markdown\nLanguages identifiers\n=====================\n\n"
-        for language in self.languages_identifiers:
-            msg += "- " + language + (" " * (18 - len(language))) + "--> " + \
-                " / ".join(self.languages_identifiers[language]) + "\n"
-        msg += "```"
-        await ctx.channel.send(msg)
+        await self.paged_messages.send(ctx.channel,
+                                       self.lists_pages["identifiers"],
+                                       ctx.message.author.id)
 
     @commands.command()
     async def list_extensions(self, ctx):
         """Lists all the languages files extensions recognized by the bot"""
-        msg = ("```Markdown\nLanguages files extensions"
-               "\n=====================\n\n")
-        for language in self.languages_files_extensions:
-            msg += "- " + language + (" " * (18 - len(language))) + "--> ." + \
-                " / .".join(self.languages_files_extensions[language]) + "\n"
-        msg += "```"
-        await ctx.channel.send(msg)
+        await self.paged_messages.send(ctx.channel,
+                                       self.lists_pages["extensions"],
+                                       ctx.message.author.id)
 
     @commands.command()
     async def list_main_file_names(self, ctx):
         """Lists the main files names for the different languages"""
-        msg = "```Markdown\nMain files names\n=====================\n\n"
-        for language in self.languages_files_extensions:
-            extension = self.languages_files_extensions[language][0]
-            msg += "- " + language + (" " * (18 - len(language))) + "--> prog"\
-                + ("." if extension != "" else "") + extension + "\n"
-        msg += "```"
-        await ctx.channel.send(msg)
+        await self.paged_messages.send(ctx.channel,
+                                       self.lists_pages["main_file_names"],
+                                       ctx.message.author.id)
+
+    async def set_user_config(self, user: discord.Member, attribute: str,
+                              value):
+
+        def update(users_configuration: dict):
+            user_id = str(user.id)
+            if user_id not in users_configuration:
+                users_configuration[user_id] = {}
+            users_configuration[user_id][attribute] = value
+
+        await self.update_users_configuration(update)
+
+    async def set_user_sub_config(self, user: discord.Member,
+                                  sub_config_name: str, attribute: str, value):
 
-    def set_user_config(self, user: discord.Member, attribute: str, value):
-        if user.id not in self.users_configuration:
-            self.users_configuration[user.id] = {}
-        self.users_configuration[user.id][attribute] = value
-        utils.save_json(self.users_configuration, self.users_configuration_path)
-
-    def set_user_sub_config(self, user: discord.Member, sub_config_name: str,
-                            attribute: str, value):
-        if user.id not in self.users_configuration:
-            self.users_configuration[user.id] = {}
-        if sub_config_name not in self.users_configuration[user.id]:
-            self.users_configuration[user.id][sub_config_name] = {}
-        self.users_configuration[user.id][sub_config_name][attribute] = value
-        utils.save_json(self.users_configuration, self.users_configuration_path)
+        def update(users_configuration: dict):
+            user_id = str(user.id)
+            if user_id not in users_configuration:
+                users_configuration[user_id] = {}
+            if sub_config_name not in users_configuration[user_id]:
+                users_configuration[user_id][sub_config_name] = {}
+            users_configuration[user_id][sub_config_name][attribute] = value
+
+        await self.update_users_configuration(update)
 
     @commands.group()
     async def config(self, ctx: commands.Context):
@@ -767,7 +1733,7 @@ class Code(commands.Cog):
             await ctx.channel.send("Please choose one of the following option: "
                                    "EVERYTHING / OUTPUT_ONLY.")
         else:
-            self.set_user_config(
+            await self.set_user_config(
                 ctx.message.author, "output_only",
                 (True if output_mode == "OUTPUT_ONLY" else False))
             await ctx.channel.send("Done.")
@@ -776,9 +1742,9 @@ class Code(commands.Cog):
     async def reset(self, ctx):
         """Resets your configuration"""
         if ctx.message.author.id in self.users_configuration:
-            del self.users_configuration[ctx.message.author.id]
-            utils.save_json(self.users_configuration,
-                            self.users_configuration_path)
+            await self.update_users_configuration(
+                lambda users_configuration: users_configuration.pop(
+                    str(ctx.message.author.id), None))
             await ctx.channel.send("Done.")
         else:
             await ctx.channel.send("You hadn't any configured settings.")
@@ -819,8 +1785,9 @@ class Code(commands.Cog):
                 "available engine for " + language_name + ", please use `" +
                 self.bot.prefix + "list_engines " + language_name + "`")
             return
-        self.set_user_sub_config(ctx.message.author, "engines", language_name,
-                                 [engine_template_name, engine_name])
+        await self.set_user_sub_config(ctx.message.author, "engines",
+                                       language_name,
+                                       [engine_template_name, engine_name])
         await ctx.channel.send("Done.")
 
     @config.command()
@@ -846,8 +1813,9 @@ class Code(commands.Cog):
                 "for the bot.\nTo list all the available languages, "
                 "please use `" + self.bot.prefix + "list_languages`.")
             return
-        self.set_user_sub_config(ctx.message.author, "compiler_options",
-                                 language_name, compiler_options)
+        await self.set_user_sub_config(ctx.message.author,
+                                       "compiler_options", language_name,
+                                       compiler_options)
         await ctx.channel.send("Done.")
 
     @config.command()
@@ -872,8 +1840,9 @@ class Code(commands.Cog):
                 "the bot.\nTo list all the available languages, please use `" +
                 self.bot.prefix + "list_languages`.")
             return
-        self.set_user_sub_config(ctx.message.author, "runtime_options",
-                                 language_name, runtime_options)
+        await self.set_user_sub_config(ctx.message.author,
+                                       "runtime_options", language_name,
+                                       runtime_options)
         await ctx.channel.send("Done.")
 
     @config.command()
@@ -882,29 +1851,38 @@ class Code(commands.Cog):
         if ctx.message.author.id not in self.users_configuration:
             await ctx.channel.send("You don't have any settings set.")
             return
-        msg = "```Markdown\nSettings\n==========\n\n"
-        config = self.users_configuration[ctx.message.author.id]
+        config_pages = self.configs_pages.get(ctx.message.author.id)
+        if not config_pages:
+            config_pages = self.render_config(
+                self.users_configuration[ctx.message.author.id])
+            self.configs_pages[ctx.message.author.id] = config_pages
+        await self.paged_messages.send(ctx.channel, config_pages,
+                                       ctx.message.author.id)
+
+    def render_config(self, config: dict):
+        """Renders the pages of the config show command for a user"""
+        lines = []
         for setting in config:
             if setting == "output_only":
-                msg += "[Output](" + ("Only result" if config[setting] ==
-                                      "OUTPUT_ONLY" else "Everything") + ")\n"
+                lines.append("[Output](" +
+                             ("Only result" if config[setting] ==
+                              "OUTPUT_ONLY" else "Everything") + ")\n")
             elif setting == "engines":
-                msg += "<Engines>\n"
+                lines.append("<Engines>\n")
                 for language in config["engines"]:
-                    msg += "\t" + language + " --> " + \
-                        config["engines"][language][1] + "\n"
+                    lines.append("\t" + language + " --> " +
+                                 config["engines"][language][1] + "\n")
             elif setting == "compiler_options":
-                msg += "<Compiler options>\n"
+                lines.append("<Compiler options>\n")
                 for language in config["compiler_options"]:
-                    msg += "\t" + language + " --> " + \
-                        config["compiler_options"][language] + "\n"
+                    lines.append("\t" + language + " --> " +
+                                 config["compiler_options"][language] + "\n")
             elif setting == "runtime_options":
-                msg += "<Runtime options>\n"
+                lines.append("<Runtime options>\n")
                 for language in config["runtime_options"]:
-                    msg += "\t" + language + " --> " + \
-                        config["runtime_options"][language] + "\n"
-        msg += "```"
-        await ctx.channel.send(msg)
+                    lines.append("\t" + language + " --> " +
+                                 config["runtime_options"][language] + "\n")
+        return pages.paginate("```Markdown\nSettings\n==========\n\n", lines)
 
 
 def setup(bot):
@@ -0,0 +1,47 @@
+"""Caches"""
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A mapping which forgets its least recently used items once it holds
+    more than `size` items.
+    `on_evict` is called with the key and the value of each forgotten item"""
+
+    def __init__(self, size: int, on_evict=None):
+        self.size = size
+        self.on_evict = on_evict
+        self.data = OrderedDict()
+
+    def get(self, key, default=None):
+        """Gets an item, marking it as recently used"""
+        if key not in self.data:
+            return default
+        self.data.move_to_end(key)
+        return self.data[key]
+
+    def pop(self, key, default=None):
+        """Removes an item and returns it"""
+        return self.data.pop(key, default)
+
+    def values(self):
+        return self.data.values()
+
+    def keys(self):
+        return self.data.keys()
+
+    def items(self):
+        return self.data.items()
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        while len(self.data) > self.size:
+            evicted = self.data.popitem(last=False)
+            if self.on_evict:
+                self.on_evict(*evicted)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
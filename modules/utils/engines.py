@@ -0,0 +1,52 @@
+"""Catalog of the wandbox engines"""
+import sys
+
+
+class EngineInfo:
+    """What the bot uses of an engine of the wandbox list. Slotted, as there
+    are hundreds of them"""
+    __slots__ = ("display_compile_command", "compiler_option_raw",
+                 "runtime_option_raw")
+
+    def __init__(self, display_compile_command: str,
+                 compiler_option_raw: bool, runtime_option_raw: bool):
+        self.display_compile_command = display_compile_command
+        self.compiler_option_raw = compiler_option_raw
+        self.runtime_option_raw = runtime_option_raw
+
+    @classmethod
+    def from_wandbox(cls, info: dict):
+        return cls(info["display-compile-command"],
+                   bool(info["compiler-option-raw"]),
+                   bool(info["runtime-option-raw"]))
+
+
+def build_catalog(wandbox_list: list):
+    """Returns the engines of the wandbox list (list.json) by language, then
+    by template, then by name. The names are interned, as they're repeated
+    for each engine and used as keys"""
+    catalog = {}
+    for info in wandbox_list:
+        language = info["language"]
+        # Warning: info["template"] is a list but it only contains
+        # one element at the moment. So I'm just gonna consider
+        # it as a str and not as a list. It may change in the
+        # future, I don't know ¯\_(ツ)_/¯
+        # Some languages have only one template
+        template = info["templates"][0]
+        # I don't know why there is a C++ and CPP language, as
+        # CPP language seems to be exactly the same that C++
+        # (with only 2 compilers which can be already found in
+        # C++ language). So I'm just gonna ignore that.
+        # OpenSSL isn't gonna be supported neither.
+        if language == "CPP" or language == "OpenSSL":
+            continue
+        # Prettify languages names
+        if language == "Bash script":
+            language = "Bash"
+        elif language == "Vim script":
+            language = "Vim"
+        templates = catalog.setdefault(sys.intern(language), {})
+        engines = templates.setdefault(sys.intern(template), {})
+        engines[sys.intern(info["name"])] = EngineInfo.from_wandbox(info)
+    return catalog
@@ -0,0 +1,114 @@
+"""Memory diagnostics"""
+from collections import Counter
+from collections import deque
+import gc
+import os
+import sys
+import tracemalloc
+
+# Containers walked by structure_census, other objects are counted as
+# leaves (to avoid walking the whole bot through references)
+_CONTAINERS = (dict, list, tuple, set, frozenset, deque)
+
+
+def get_rss():
+    """Returns the resident set size of the process in bytes, or its peak if
+    the current one isn't available, or None"""
+    try:
+        with open("/proc/self/statm") as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf(
+                "SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def format_size(size: int):
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024:
+            return ("%d" if unit == "B" else "%.1f") % size + " " + unit
+        size /= 1024
+    return "%.1f GiB" % size
+
+
+def structure_census(structure):
+    """Counts the objects of a structure by type, walking through the
+    builtin containers and the slotted objects. Returns a dict of type
+    name -> [count, size]"""
+    census = {}
+    seen = set()
+    to_visit = [structure]
+    while to_visit:
+        obj = to_visit.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        type_name = type(obj).__name__
+        if type_name not in census:
+            census[type_name] = [0, 0]
+        census[type_name][0] += 1
+        census[type_name][1] += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            to_visit.extend(obj.keys())
+            to_visit.extend(obj.values())
+        elif isinstance(obj, _CONTAINERS):
+            to_visit.extend(obj)
+        elif hasattr(type(obj), "__slots__"):
+            to_visit.extend(
+                getattr(obj, slot) for slot in type(obj).__slots__
+                if hasattr(obj, slot))
+    return census
+
+
+def gc_census(count: int = 20):
+    """Returns the `count` most common types of the objects tracked by the
+    garbage collector, as (type name, count)"""
+    return Counter(type(obj).__name__
+                   for obj in gc.get_objects()).most_common(count)
+
+
+class MemoryTracker:
+    """Takes tracemalloc snapshots, and compares them to a baseline"""
+
+    def __init__(self):
+        self.baseline = None
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def start(self, nb_frames: int = 1):
+        """Starts tracing the allocations, and takes the baseline"""
+        tracemalloc.start(nb_frames)
+        self.baseline = tracemalloc.take_snapshot()
+
+    def stop(self):
+        tracemalloc.stop()
+        self.baseline = None
+
+    def reset_baseline(self):
+        self.baseline = tracemalloc.take_snapshot()
+
+    def report(self, count: int = 25):
+        """Returns the top allocation sites, and the top differences with
+        the baseline"""
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),))
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [
+            "Traced memory: " + format_size(current) + " (peak: " +
+            format_size(peak) + ")", "", "Top allocation sites:"
+        ]
+        lines += [str(stat) for stat in snapshot.statistics("lineno")[:count]]
+        lines += ["", "Top differences with the baseline:"]
+        lines += [
+            str(stat)
+            for stat in snapshot.compare_to(self.baseline, "lineno")[:count]
+        ]
+        return "\n".join(lines)
@@ -0,0 +1,278 @@
+"""Metrics, exposed in Prometheus text format"""
+import asyncio
+import time
+
+# Default histograms buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   15, 30)
+
+
+def _labels_key(labels: dict):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple, extra: tuple = ()):
+    labels = key + extra
+    if not labels:
+        return ""
+    return "{" + ",".join(
+        name + "=\"" + str(value).replace("\\", "\\\\").replace(
+            "\"", "\\\"").replace("\n", "\\n") + "\""
+        for name, value in labels) + "}"
+
+
+def _format_value(value: float):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A value which only goes up, for each set of labels"""
+    type_name = "counter"
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(_labels_key(labels), 0)
+
+    def render(self):
+        return [
+            self.name + _format_labels(key) + " " + _format_value(value)
+            for key, value in self.values.items()
+        ]
+
+
+class Gauge(Counter):
+    """A value which can go up and down. If `function` is set, it's called
+    to get the value when rendering"""
+    type_name = "gauge"
+
+    def __init__(self, name: str, description: str, function=None):
+        super().__init__(name, description)
+        self.function = function
+
+    def set(self, value: float, **labels):
+        self.values[_labels_key(labels)] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels):
+        if self.function:
+            return self.function()
+        return super().get(**labels)
+
+    def render(self):
+        if self.function:
+            return [self.name + " " + _format_value(self.function())]
+        return super().render()
+
+
+class Histogram:
+    """Distribution of observed values in buckets, for each set of
+    labels"""
+    type_name = "histogram"
+
+    def __init__(self,
+                 name: str,
+                 description: str,
+                 buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # Labels key -> [buckets counts (not cumulative), sum, count]
+        self.values = {}
+
+    def observe(self, value: float, **labels):
+        key = _labels_key(labels)
+        if key not in self.values:
+            self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        data = self.values[key]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                data[0][i] += 1
+                break
+        data[1] += value
+        data[2] += 1
+
+    def time(self, **labels):
+        """Context manager observing the time spent in its block"""
+        return _Timer(self, labels)
+
+    def count(self, **labels):
+        data = self.values.get(_labels_key(labels))
+        return data[2] if data else 0
+
+    def quantile(self, quantile: float, **labels):
+        """Estimates a quantile from the buckets, as Prometheus'
+        histogram_quantile does (None if there is no observation)"""
+        data = self.values.get(_labels_key(labels))
+        return self._quantile(data, quantile) if data else None
+
+    def _quantile(self, data: list, quantile: float):
+        rank = quantile * data[2]
+        cumulative = 0
+        lower_bound = 0.0
+        for bound, count in zip(self.buckets, data[0]):
+            if count and cumulative + count >= rank:
+                if bound == float("inf"):
+                    return lower_bound
+                return lower_bound + (bound - lower_bound) * \
+                    (rank - cumulative) / count
+            cumulative += count
+            lower_bound = bound
+        return lower_bound
+
+    def summary(self):
+        """Returns (labels, count, mean, p50, p95, p99) for each set of
+        labels"""
+        return [(dict(key), data[2], data[1] / data[2],
+                 self._quantile(data, 0.5), self._quantile(data, 0.95),
+                 self._quantile(data, 0.99))
+                for key, data in self.values.items()
+                if data[2]]
+
+    def render(self):
+        lines = []
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(self.name + "_bucket" + _format_labels(
+                    key, (("le", _format_value(bound)),)) + " " +
+                             str(cumulative))
+            lines.append(self.name + "_sum" + _format_labels(key) + " " +
+                         _format_value(total))
+            lines.append(self.name + "_count" + _format_labels(key) + " " +
+                         str(count))
+        return lines
+
+
+class _Timer:
+
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+        self.begin = None
+
+    def __enter__(self):
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter() - self.begin,
+                               **self.labels)
+
+
+class MetricsRegistry:
+    """Registry of the metrics of the bot.
+    Getting a metric which already exists returns it, so that modules can
+    be reloaded without losing their metrics"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.server = None
+
+    def _get(self, metric_class, name: str, *args):
+        if name not in self.metrics:
+            self.metrics[name] = metric_class(name, *args)
+        return self.metrics[name]
+
+    def counter(self, name: str, description: str):
+        return self._get(Counter, name, description)
+
+    def gauge(self, name: str, description: str, function=None):
+        gauge = self._get(Gauge, name, description)
+        gauge.function = function
+        return gauge
+
+    def histogram(self,
+                  name: str,
+                  description: str,
+                  buckets: tuple = DEFAULT_BUCKETS):
+        return self._get(Histogram, name, description, buckets)
+
+    def render(self):
+        """Renders the metrics in Prometheus text format"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append("# HELP " + metric.name + " " + metric.description)
+            lines.append("# TYPE " + metric.name + " " + metric.type_name)
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+    def summarize(self):
+        """Returns a human readable summary of the metrics: percentiles of
+        the histograms (in milliseconds), values of the counters and gauges
+        and hit rates of the caches"""
+        lines = []
+        for metric in self.metrics.values():
+            if isinstance(metric, Histogram):
+                for labels, count, mean, p50, p95, p99 in metric.summary():
+                    lines.append(
+                        metric.name + _format_labels(_labels_key(labels)) +
+                        ": " + str(count) + " observations, mean " +
+                        "%.1f" % (mean * 1000) + "ms, p50 " + "%.1f" %
+                        (p50 * 1000) + "ms, p95 " + "%.1f" %
+                        (p95 * 1000) + "ms, p99 " + "%.1f" % (p99 * 1000) +
+                        "ms")
+            else:
+                lines += metric.render()
+            if isinstance(metric, Counter) and \
+                    metric.name == "discode_cache_requests_total":
+                lines += self._summarize_hit_rates(metric)
+        return "\n".join(lines)
+
+    def _summarize_hit_rates(self, counter: Counter):
+        hits = {}
+        for key, value in counter.values.items():
+            labels = dict(key)
+            cache = labels.get("cache", "")
+            hits.setdefault(cache, [0, 0])
+            hits[cache][labels.get("result") != "hit"] += value
+        return [
+            "hit rate of the " + cache + " cache: " + "%.1f" %
+            (100 * hit / (hit + miss)) + "%"
+            for cache, (hit, miss) in hits.items()
+            if hit + miss
+        ]
+
+    async def measure_loop_lag(self, loop, interval: float = 0.5):
+        """Measures the lag of the event loop, forever"""
+        histogram = self.histogram(
+            "discode_event_loop_lag_seconds",
+            "Delay of the event loop callbacks",
+            (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+        while True:
+            begin = loop.time()
+            await asyncio.sleep(interval)
+            histogram.observe(max(0.0, loop.time() - begin - interval))
+
+    async def start_server(self, host: str, port: int):
+        """Serves the metrics on http://host:port/metrics"""
+        from aiohttp import web
+
+        async def handle(request):
+            return web.Response(text=self.render(),
+                                content_type="text/plain",
+                                charset="utf-8")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        self.server = runner
+        await web.TCPSite(runner, host, port).start()
+
+    async def stop_server(self):
+        if self.server:
+            await self.server.cleanup()
+            self.server = None
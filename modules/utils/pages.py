@@ -0,0 +1,79 @@
+"""Messages too long for Discord, split in pages browsed with reactions"""
+import discord
+
+from modules.utils.cache import LRUCache
+
+PREVIOUS_PAGE = "\u25c0"
+NEXT_PAGE = "\u25b6"
+
+
+def paginate(header: str, lines: list, footer: str = "```",
+             limit: int = 2000):
+    """Splits lines in pages of at most `limit` characters, each one
+    starting with `header` and ending with `footer`. The pages are numbered
+    if there are several ones"""
+    # Room for the page number
+    room = limit - len(header) - len(footer) - len("\n> Page 999/999\n")
+    chunks = [[]]
+    size = 0
+    for line in lines:
+        line = line[:room]
+        if size + len(line) > room and chunks[-1]:
+            chunks.append([])
+            size = 0
+        chunks[-1].append(line)
+        size += len(line)
+    if len(chunks) == 1:
+        return [header + "".join(chunks[0]) + footer]
+    return [
+        header + "".join(chunk) + "\n> Page " + str(i + 1) + "/" +
+        str(len(chunks)) + "\n" + footer for i, chunk in enumerate(chunks)
+    ]
+
+
+class PagedMessages:
+    """Messages sent with several pages, whose author can turn the pages by
+    adding or removing the reactions of the message (so that the bot
+    doesn't need the permission to remove them)"""
+
+    def __init__(self, size: int = 256):
+        # Message ID -> {"pages", "page", "author"}
+        self.messages = LRUCache(size)
+
+    async def send(self, channel, pages: list, author_id: int):
+        """Sends the first page in a channel"""
+        message = await channel.send(pages[0])
+        if len(pages) > 1:
+            self.messages[message.id] = {
+                "pages": pages,
+                "page": 0,
+                "author": author_id
+            }
+            try:
+                await message.add_reaction(PREVIOUS_PAGE)
+                await message.add_reaction(NEXT_PAGE)
+            except discord.HTTPException:
+                pass
+        return message
+
+    async def turn_page(self, bot, payload):
+        """Shows the previous or the next page of a message, when its author
+        reacts"""
+        paged_message = self.messages.get(payload.message_id)
+        if not paged_message or payload.user_id != paged_message["author"]:
+            return
+        if payload.emoji.name == PREVIOUS_PAGE:
+            page = paged_message["page"] - 1
+        elif payload.emoji.name == NEXT_PAGE:
+            page = paged_message["page"] + 1
+        else:
+            return
+        channel = bot.get_channel(payload.channel_id)
+        if not channel or not 0 <= page < len(paged_message["pages"]):
+            return
+        paged_message["page"] = page
+        try:
+            await channel.get_partial_message(payload.message_id).edit(
+                content=paged_message["pages"][page])
+        except discord.HTTPException:
+            pass
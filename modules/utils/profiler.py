@@ -0,0 +1,86 @@
+"""Sampling profiler, cheap enough to be used on the running bot"""
+from collections import Counter
+import os
+import sys
+import threading
+
+
+class SamplingProfiler:
+    """Samples the stack of a thread (the one starting the profiler, i.e.
+    the event loop's one) every `interval` seconds, from a background thread.
+    The profiled code isn't instrumented, so the overhead only depends on
+    the sampling rate"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.thread_id = None
+        self.thread = None
+        self.stop_event = threading.Event()
+        # Collapsed stack -> number of samples
+        self.samples = Counter()
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        self.thread_id = threading.get_ident()
+        self.samples.clear()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.sample,
+                                       name="profiler",
+                                       daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+
+    def sample(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame:
+                self.samples[self.collapse(frame)] += 1
+            # Don't keep the profiled frames alive
+            del frame
+
+    @staticmethod
+    def collapse(frame):
+        """Returns a stack as "outermost;...;innermost" """
+        functions = []
+        while frame:
+            code = frame.f_code
+            functions.append(code.co_name + " (" +
+                             os.path.basename(code.co_filename) + ":" +
+                             str(code.co_firstlineno) + ")")
+            frame = frame.f_back
+        return ";".join(reversed(functions))
+
+    def top_functions(self, count: int = 20):
+        """Returns the `count` functions with the most own samples, as
+        (function, own samples, total samples (with the called functions))"""
+        own = Counter()
+        total = Counter()
+        for stack, samples in self.samples.items():
+            functions = stack.split(";")
+            own[functions[-1]] += samples
+            for function in set(functions):
+                total[function] += samples
+        return [(function, samples, total[function])
+                for function, samples in own.most_common(count)]
+
+    def collapsed_stacks(self):
+        """Returns the samples in the collapsed stacks format, used by
+        flamegraph.pl or speedscope"""
+        return "\n".join(stack + " " + str(samples)
+                         for stack, samples in self.samples.items()) + "\n"
+
+    def format_top_functions(self, count: int = 20):
+        nb_samples = sum(self.samples.values()) or 1
+        lines = ["  own  total  function"]
+        for function, own, total in self.top_functions(count):
+            lines.append(("%.1f%%" % (100 * own / nb_samples)).rjust(5) +
+                         ("%.1f%%" % (100 * total / nb_samples)).rjust(7) +
+                         "  " + function)
+        return "\n".join(lines)
@@ -0,0 +1,105 @@
+"""Rendering of the results of the runs. It doesn't depend on the bot, so
+that it can be done by the worker processes of the code module (see
+workers.py)"""
+import async_timeout
+import discord
+
+
+async def create_pastebin(session, pastebin_url: str, api_key: str,
+                          paste_name: str, paste_code: str):
+    """Creates a pastebin, returns its status and its url"""
+    async with async_timeout.timeout(15):
+        async with session.post(pastebin_url + "api/api_post.php",
+                                data={
+                                    "api_dev_key": api_key,
+                                    "api_option": "paste",
+                                    "api_paste_code": paste_code,
+                                    "api_paste_private": "1",
+                                    "api_paste_name": paste_name,
+                                    "api_paste_expire_date": "1W"
+                                }) as response:
+            return response.status, await response.text()
+
+
+def set_embed_infos(embed: discord.Embed, infos: dict):
+    """Sets the timestamp, the footer, the thumbnail and the author of a
+    result embed"""
+    embed.timestamp = infos["timestamp"]
+    embed.set_footer(text=infos["footer"], icon_url=infos["footer_icon"])
+    embed.set_thumbnail(url=infos["thumbnail"])
+    embed.set_author(name=infos["author"], icon_url=infos["author_icon"])
+
+
+async def add_long_field(embed: discord.Embed, parameter_name: str,
+                         result: dict, field_name: str, upload):
+    """Adds a long field to the embed. Link a pastebin (created by the
+    `upload` coroutine) in case the field value is too long"""
+    if parameter_name in result:
+        if len(result[parameter_name])\
+                > 1022 or result[parameter_name].count("\n") > 20:
+            url = await upload(field_name, result[parameter_name])
+            delimiter = url.rfind("/")
+            url = url[:delimiter] + "/raw" + url[delimiter:]
+            embed.add_field(name=field_name,
+                            value=":page_facing_up: [" + field_name +
+                            ".txt](" + url + ")",
+                            inline=False)
+        else:
+            embed.add_field(name=field_name,
+                            value="`" + result[parameter_name] + "`",
+                            inline=False)
+
+
+async def create_embed_result(job: dict, upload):
+    """Returns an embed corresponding to the Wandbox compile result of a
+    render job (see Code.create_render_job)"""
+    # field amount = 25, title/field name = 256, value = 1024, footer
+    # text/description = 2048 Note that the sum of all characters
+    # in the embed should be less than or equal to 6000.
+    info = job["result"]
+    embed = discord.Embed()
+    embed.title = "Results"
+    if "url" in info:
+        embed.url = info["url"]
+    embed.add_field(name="Engine used", value=job["engine"], inline=True)
+    embed.add_field(name="Command used", value=job["command"], inline=True)
+    if "compiler_error" in info or "program_error" in info:
+        if "status" not in info or info["status"] != '0':
+            embed.colour = discord.Color.red()
+        else:
+            embed.colour = discord.Color.orange()
+    elif "signal" in info:
+        embed.colour = discord.Color.red()
+    elif info["status"] != '0':
+        embed.colour = discord.Color.orange()
+    else:
+        embed.colour = discord.Color.green()
+    set_embed_infos(embed, job["infos"])
+
+    if "status" in info:
+        embed.add_field(name="Exit status", value=info["status"], inline=False)
+
+    await add_long_field(embed, "signal", info, "Signal", upload)
+    await add_long_field(embed, "compiler_output", info, "Compiler output",
+                         upload)
+    await add_long_field(embed, "compiler_error", info,
+                         "Compiler warnings / errors", upload)
+    await add_long_field(embed, "program_output", info, "Output", upload)
+    await add_long_field(embed, "program_error", info, "Runtime errors",
+                         upload)
+
+    return embed
+
+
+async def render_run_result(job: dict, upload):
+    """Returns the content and the embed of the message showing the result
+    of a run"""
+    result = job["result"]
+    if not job["output_only"] or "compiler_error" in result \
+            or "program_error" in result:
+        return None, await create_embed_result(job, upload)
+    if len(result["program_output"])\
+            > 1998 or result["program_output"].count('\n') > 20:
+        return "Output here: <" + await upload(
+            "Output", result["program_output"]) + '>', None
+    return '`' + result["program_output"] + '`', None
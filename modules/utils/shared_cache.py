@@ -0,0 +1,109 @@
+"""Cache shared by the processes of the bot running on a same host"""
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+
+
+class SharedCache:
+    """Key-value cache stored in an SQLite database, so that all the
+    processes using the same file share it, and that it survives their
+    restarts. The values are JSON serializable. The least recently used
+    entries are evicted once the values take more than `max_size` bytes"""
+
+    def __init__(self, file_path: str, max_size: int = 64 * 1024 * 1024):
+        self.max_size = max_size
+        # Queries are done by the default executor
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(file_path,
+                                          timeout=5,
+                                          check_same_thread=False,
+                                          isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # So that the rows replaced by INSERT OR REPLACE fire the delete
+        # trigger
+        self.connection.execute("PRAGMA recursive_triggers=ON")
+        self.connection.execute("BEGIN IMMEDIATE")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS entries ("
+                                "namespace TEXT, key TEXT, value TEXT, "
+                                "size INTEGER, accessed REAL, expires REAL, "
+                                "PRIMARY KEY (namespace, key))")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed "
+                                "ON entries (accessed)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS entries_expires "
+                                "ON entries (expires)")
+        # Total size of the values, kept up to date by triggers so that
+        # the entries don't have to be summed up for each write
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta ("
+                                "id INTEGER PRIMARY KEY CHECK (id = 0), "
+                                "total_size INTEGER)")
+        self.connection.execute("INSERT OR IGNORE INTO meta VALUES "
+                                "(0, (SELECT TOTAL(size) FROM entries))")
+        self.connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON "
+            "entries BEGIN UPDATE meta SET total_size = total_size + "
+            "NEW.size; END")
+        self.connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON "
+            "entries BEGIN UPDATE meta SET total_size = total_size - "
+            "OLD.size; END")
+        self.connection.execute("COMMIT")
+
+    def get(self, namespace: str, key: str):
+        """Returns the value of an entry, None if there isn't any"""
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM entries WHERE namespace = ? AND key = ? "
+                "AND (expires IS NULL OR expires > ?)",
+                (namespace, key, now)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                "UPDATE entries SET accessed = ? WHERE namespace = ? "
+                "AND key = ?", (now, namespace, key))
+        return json.loads(row[0])
+
+    def set(self, namespace: str, key: str, value, ttl: float = None):
+        """Sets an entry, which expires after `ttl` seconds if set"""
+        now = time.time()
+        value = json.dumps(value)
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, value, len(value), now,
+                 now + ttl if ttl else None))
+            self.evict(now)
+
+    def evict(self, now: float):
+        """Removes the expired entries, then the least recently used ones
+        while the values take more than max_size bytes"""
+        self.connection.execute("DELETE FROM entries WHERE expires <= ?",
+                                (now,))
+        total_size = self.connection.execute(
+            "SELECT total_size FROM meta").fetchone()[0]
+        if total_size <= self.max_size:
+            return
+        evicted = []
+        for rowid, size in self.connection.execute(
+                "SELECT rowid, size FROM entries ORDER BY accessed"):
+            if total_size <= self.max_size:
+                break
+            evicted.append((rowid,))
+            total_size -= size
+        self.connection.executemany("DELETE FROM entries WHERE rowid = ?",
+                                    evicted)
+
+    async def get_async(self, namespace: str, key: str):
+        return await asyncio.get_event_loop().run_in_executor(
+            None, self.get, namespace, key)
+
+    async def set_async(self, namespace: str, key: str, value,
+                        ttl: float = None):
+        await asyncio.get_event_loop().run_in_executor(
+            None, self.set, namespace, key, value, ttl)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
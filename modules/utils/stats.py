@@ -0,0 +1,62 @@
+"""Statistics of the bot"""
+import discord
+
+
+class BotStats:
+    """Numbers of guilds, channels and members, computed once and then kept
+    up to date by the gateway events. The bot doesn't have the members
+    intent, so the members of a guild are counted when it's received"""
+
+    def __init__(self):
+        self.guilds = 0
+        self.text_channels = 0
+        self.voice_channels = 0
+        self.members = 0
+
+    def reset(self, guilds: list):
+        """Computes the statistics from scratch (when the bot is ready, as the
+        cache is rebuilt)"""
+        self.guilds = 0
+        self.text_channels = 0
+        self.voice_channels = 0
+        self.members = 0
+        for guild in guilds:
+            self.add_guild(guild)
+
+    def add_guild(self, guild: discord.Guild, sign: int = 1):
+        self.guilds += sign
+        self.text_channels += sign * len(guild.text_channels)
+        self.voice_channels += sign * len(guild.voice_channels)
+        self.members += sign * (guild.member_count or 0)
+
+    def add_channel(self, channel, sign: int = 1):
+        if isinstance(channel, discord.TextChannel):
+            self.text_channels += sign
+        elif isinstance(channel, discord.VoiceChannel):
+            self.voice_channels += sign
+
+    def to_dict(self):
+        return {
+            "guilds": self.guilds,
+            "text_channels": self.text_channels,
+            "voice_channels": self.voice_channels,
+            "members": self.members
+        }
+
+    async def on_guild_join(self, guild):
+        self.add_guild(guild)
+
+    async def on_guild_remove(self, guild):
+        self.add_guild(guild, -1)
+
+    async def on_guild_channel_create(self, channel):
+        self.add_channel(channel)
+
+    async def on_guild_channel_delete(self, channel):
+        self.add_channel(channel, -1)
+
+    def add_listeners(self, bot):
+        for listener in (self.on_guild_join, self.on_guild_remove,
+                         self.on_guild_channel_create,
+                         self.on_guild_channel_delete):
+            bot.add_listener(listener)
@@ -0,0 +1,148 @@
+"""Lightweight tracing of the commands"""
+from collections import deque
+import json
+import random
+import time
+
+
+class Span:
+    """A timed stage of a trace. It can be used as a context manager or be
+    ended explicitly"""
+
+    def __init__(self, trace, name: str, attributes: dict):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+        self.begin = time.perf_counter()
+        self.end_time = None
+        self.error = None
+
+    @property
+    def duration(self):
+        return (self.end_time or time.perf_counter()) - self.begin
+
+    def end(self):
+        if self.end_time is None:
+            self.end_time = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type:
+            self.error = exc_type.__name__
+        self.end()
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "start": self.begin - self.trace.begin,
+            "duration": self.duration,
+            "attributes": self.attributes,
+            "error": self.error
+        }
+
+
+class Trace:
+    """The spans of a command invocation"""
+
+    def __init__(self, trace_id: str, name: str, attributes: dict):
+        self.id = trace_id
+        self.name = name
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.begin = time.perf_counter()
+        self.end_time = None
+        self.status = None
+        self.spans = []
+
+    @property
+    def duration(self):
+        return (self.end_time or time.perf_counter()) - self.begin
+
+    def span(self, name: str, **attributes):
+        """Starts a span, which must then be ended"""
+        span = Span(self, name, attributes)
+        self.spans.append(span)
+        return span
+
+    def finish(self, status: str = "ok"):
+        """Ends the trace, and the spans which haven't been ended"""
+        self.end_time = time.perf_counter()
+        self.status = status
+        for span in self.spans:
+            if span.end_time is None:
+                span.end_time = self.end_time
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "attributes": self.attributes,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "status": self.status,
+            "spans": [span.to_dict() for span in self.spans]
+        }
+
+
+class Tracer:
+    """Keeps the `size` last finished traces"""
+
+    def __init__(self, size: int = 256):
+        self.traces = deque(maxlen=size)
+
+    def start(self, name: str, **attributes):
+        return Trace("%016x" % random.getrandbits(64), name, attributes)
+
+    def finish(self, trace: Trace, status: str = "ok"):
+        trace.finish(status)
+        self.traces.append(trace)
+
+    def slowest(self, count: int = 5):
+        return sorted(self.traces, key=lambda trace: trace.duration,
+                      reverse=True)[:count]
+
+    def export(self):
+        """Returns the traces as JSON"""
+        return json.dumps([trace.to_dict() for trace in self.traces],
+                          indent=2)
+
+
+def span(ctx, name: str, **attributes):
+    """Starts a span in the trace of a command context. If the context isn't
+    traced (e.g. in the benchmarks), the span isn't recorded"""
+    trace = getattr(ctx, "trace", None)
+    if trace is None:
+        return Span(Trace("", "", {}), name, attributes)
+    return trace.span(name, **attributes)
+
+
+def record_span(ctx, name: str, begin: float, duration: float, **attributes):
+    """Records a span measured elsewhere (e.g. by a worker process), which
+    began at `begin` (time.perf_counter() of this process)"""
+    recorded = span(ctx, name, **attributes)
+    recorded.begin = begin
+    recorded.end_time = begin + duration
+
+
+def format_waterfall(trace: Trace, width: int = 32):
+    """Formats a trace as a text waterfall, one line per span"""
+    total = trace.duration or 1e-9
+    lines = [
+        trace.name + " " + trace.id + " " + "%.1f" % (total * 1000) + "ms " +
+        str(trace.status)
+    ]
+    for span in sorted(trace.spans, key=lambda span: span.begin):
+        first = min(width - 1, int((span.begin - trace.begin) / total * width))
+        length = min(width - first,
+                     max(1, round(span.duration / total * width)))
+        bar = (" " * first + "#" * length).ljust(width)
+        label = span.name + "".join(" " + name + "=" + str(value)
+                                    for name, value in span.attributes.items())
+        if span.error:
+            label += " (" + span.error + ")"
+        lines.append("|" + bar + "| " + ("%.1f" % (span.duration * 1000) +
+                                          "ms").rjust(9) + " " + label)
+    return "\n".join(lines)
+
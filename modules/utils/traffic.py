@@ -0,0 +1,94 @@
+"""Traffic recording"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+import re
+import time
+
+# User, role and channel mentions
+MENTION_REGEX = re.compile(r"<(@!?|@&|#)(\d+)>")
+
+
+class TrafficRecorder:
+    """Records the commands received by the bot and their timing, without
+    identifying data, so that they can be replayed later (see
+    benchmarks/replay.py).
+
+    Each line of the file is a JSON object:
+        time: Seconds since the beginning of the recording
+        author / channel / guild: Anonymized IDs
+        prefix: "mention" or "prefix"
+        content: The content of the message without its prefix, the IDs
+                 of the mentions are anonymized
+
+    The records are kept in memory, and written by run (or close) in a
+    thread of their own, so that recording doesn't block the event loop"""
+
+    def __init__(self, file_path: str):
+        self.file = open(file_path, encoding="utf-8", mode="a")
+        # Records not written yet
+        self.pending = []
+        # A single thread, so that the records are written in order
+        self.writer = ThreadPoolExecutor(1)
+        # A new salt for each recording, so that the IDs of different
+        # recordings can't be matched
+        self.salt = os.urandom(16)
+        self.started_at = time.monotonic()
+
+    def anonymize(self, identifier: int):
+        """Returns an anonymized ID, stable during a recording"""
+        digest = hashlib.sha256(self.salt + str(identifier).encode()).digest()
+        return int.from_bytes(digest[:7], "big")
+
+    def sanitize(self, content: str):
+        """Anonymizes the IDs of the mentions of a message"""
+        return MENTION_REGEX.sub(
+            lambda match: "<" + match.group(1) + str(
+                self.anonymize(int(match.group(2)))) + ">", content)
+
+    def record(self, message, prefixes: list):
+        """Records a message if it's a command"""
+        for i, prefix in enumerate(prefixes):
+            if message.content.startswith(prefix):
+                break
+        else:
+            return
+        self.pending.append(
+            json.dumps({
+                "time": round(time.monotonic() - self.started_at, 3),
+                "author": self.anonymize(message.author.id),
+                "channel": self.anonymize(message.channel.id),
+                "guild": self.anonymize(message.guild.id)
+                         if message.guild else None,
+                # The last prefix is the bot's prefix, the others are
+                # mentions of the bot
+                "prefix": "prefix" if i == len(prefixes) - 1 else "mention",
+                "content": self.sanitize(message.content[len(prefix):])
+            }) + "\n")
+
+    def write(self, records: list):
+        self.file.write("".join(records))
+        self.file.flush()
+
+    async def flush(self):
+        """Writes the pending records"""
+        if self.pending:
+            records, self.pending = self.pending, []
+            await asyncio.get_event_loop().run_in_executor(
+                self.writer, self.write, records)
+
+    async def run(self, interval: float = 1):
+        """Writes the pending records every `interval` seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    def close(self):
+        """Writes the pending records, then closes the file"""
+        if self.pending:
+            self.writer.submit(self.write, self.pending)
+            self.pending = []
+        self.writer.shutdown()
+        self.file.close()
@@ -1,5 +1,17 @@
 """Utilities functions"""
+import asyncio
+import contextlib
 import json
+import os
+try:
+    import fcntl
+except ImportError:
+    # Windows, where the files can't be shared by several processes (see
+    # the cluster mode of the launcher)
+    fcntl = None
+
+# Locks of the files being saved asynchronously, by file name
+_files_locks = {}
 
 
 def split_message(message: str, step: int = 2000):
@@ -16,14 +28,84 @@ def load_json(filename: str):
     return data
 
 
+def get_mtime(filename: str):
+    """Returns the modification time of a file, None if it doesn't exist"""
+    try:
+        return os.path.getmtime(filename)
+    except OSError:
+        return None
+
+
+def dump_json(data: json, should_be_sorted=True):
+    return json.dumps(data,
+                      indent=4,
+                      sort_keys=should_be_sorted,
+                      separators=(',', ': '))
+
+
 def save_json(data: json, filename: str, should_be_sorted=True):
     """Saves a json file"""
-    with open(filename, encoding="utf-8", mode="w") as file:
-        json.dump(data,
-                  file,
-                  indent=4,
-                  sort_keys=should_be_sorted,
-                  separators=(',', ': '))
+    write_file(filename, dump_json(data, should_be_sorted))
+
+
+def write_file(filename: str, content: str):
+    """Writes a file atomically: readers (other processes included) get
+    either its previous content or the new one"""
+    temp_filename = filename + "." + str(os.getpid()) + ".tmp"
+    with open(temp_filename, encoding="utf-8", mode="w") as file:
+        file.write(content)
+    os.replace(temp_filename, filename)
+
+
+@contextlib.contextmanager
+def lock_file(filename: str):
+    """Prevents the other processes of the bot from modifying a file (where
+    fcntl is available)"""
+    if fcntl is None:
+        yield
+        return
+    with open(filename + ".lock", mode="a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def update_json(filename: str, function, default: json = None):
+    """Loads a json file (`default` if it doesn't exist), modifies its data
+    in place with `function` and saves it. The other processes of the bot
+    can't modify the file meanwhile. Returns the new data"""
+    with lock_file(filename):
+        data = load_json(filename) if os.path.exists(filename) else default
+        function(data)
+        save_json(data, filename)
+    return data
+
+
+def get_file_lock(filename: str):
+    if filename not in _files_locks:
+        _files_locks[filename] = asyncio.Lock()
+    return _files_locks[filename]
+
+
+async def save_json_async(data: json, filename: str, should_be_sorted=True):
+    """Saves a json file without blocking the event loop. The data is
+    serialized right away (so it can be modified once this function
+    returns), the file is written by the default executor. The writes of
+    a file are done in order"""
+    content = dump_json(data, should_be_sorted)
+    async with get_file_lock(filename):
+        await asyncio.get_event_loop().run_in_executor(
+            None, write_file, filename, content)
+
+
+async def update_json_async(filename: str, function, default: json = None):
+    """Same as update_json, without blocking the event loop. `function` is
+    called in the default executor"""
+    async with get_file_lock(filename):
+        return await asyncio.get_event_loop().run_in_executor(
+            None, update_json, filename, function, default)
 
 
 def convert_seconds_to_str(sec: float):
@@ -0,0 +1,70 @@
+"""Detection of the callbacks blocking the event loop"""
+import asyncio
+from collections import deque
+import sys
+import threading
+import time
+import traceback
+
+
+class LoopWatchdog:
+    """Records the stack of the event loop's thread whenever a callback
+    blocks the loop for more than `threshold` seconds.
+    The loop updates a heartbeat, which is checked by a background thread,
+    so the stack is the one of the blocking callback"""
+
+    def __init__(self, threshold: float = 0.5, size: int = 50):
+        self.threshold = threshold
+        self.interval = threshold / 4
+        self.thread_id = None
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.last_beat = time.monotonic()
+        # Last blocking callbacks: {"time", "duration", "stack"}
+        self.records = deque(maxlen=size)
+        self.current_record = None
+
+    async def run(self):
+        """Updates the heartbeat forever, the thread checking it is started
+        on the loop's thread"""
+        self.thread_id = threading.get_ident()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.watch,
+                                       name="watchdog",
+                                       daemon=True)
+        self.thread.start()
+        try:
+            while True:
+                self.last_beat = time.monotonic()
+                await asyncio.sleep(self.interval)
+                record = self.current_record
+                if record:
+                    # The loop isn't blocked anymore, the real duration is
+                    # known
+                    record["duration"] = time.monotonic() - self.last_beat - \
+                        self.interval
+                    self.current_record = None
+        finally:
+            self.stop()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def watch(self):
+        while not self.stop_event.wait(self.interval):
+            blocked_for = time.monotonic() - self.last_beat - self.interval
+            if blocked_for < self.threshold or self.current_record:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.current_record = {
+                "time": time.time(),
+                "duration": blocked_for,
+                "stack": "".join(traceback.format_stack(frame))
+            }
+            del frame
+            self.records.append(self.current_record)
+            print("The event loop has been blocked for more than " +
+                  str(self.threshold) + "s:\n" +
+                  self.current_record["stack"])
@@ -0,0 +1,259 @@
+"""Pool of worker processes executing the runs of the code module and
+rendering their results, so that the process connected to Discord stays
+responsive. Each worker runs an event loop, so that it handles many jobs at
+the same time, and the jobs can be cancelled"""
+import aiohttp
+import async_timeout
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import contextvars
+import itertools
+import json
+import multiprocessing
+import pickle
+import threading
+import time
+
+from modules.utils import rendering
+
+# HTTP session of the worker process
+_session = None
+# Beginning and requests to wandbox / pastebin of the current job, see
+# measure
+_job_measures = contextvars.ContextVar("job_measures")
+
+
+async def _create_session():
+    return aiohttp.ClientSession()
+
+
+def _picklable(error: Exception):
+    """Returns an exception which can be sent back to the bot process"""
+    # Some aiohttp errors can't be pickled
+    if isinstance(error, aiohttp.ClientError):
+        return aiohttp.ClientError(str(error))
+    try:
+        pickle.dumps(error)
+    except Exception:
+        return RuntimeError(repr(error))
+    return error
+
+
+@contextlib.contextmanager
+def measure(service: str, endpoint: str):
+    """Measures a request to wandbox / pastebin of the current job (like
+    Code.measure_upstream). The status of the response must be set in the
+    yielded dict"""
+    upstream_request = {"status": "error"}
+    begin = time.perf_counter()
+    try:
+        yield upstream_request
+    finally:
+        measures = _job_measures.get()
+        measures["requests"].append(
+            (service, endpoint, upstream_request["status"],
+             begin - measures["begin"], time.perf_counter() - begin))
+
+
+async def _run_job(function, args: tuple):
+    """Runs a job, returns whether it succeeded, its result (or exception)
+    and its requests to wandbox / pastebin (service, endpoint, status,
+    start since the beginning of the job, duration)"""
+    measures = {"begin": time.perf_counter(), "requests": []}
+    _job_measures.set(measures)
+    try:
+        return True, await function(*args), measures["requests"]
+    except Exception as error:
+        return False, _picklable(error), measures["requests"]
+
+
+def _work(jobs_connection, results_connection):
+    """Main function of a worker process. It receives (job ID, function,
+    args) to start a job, (job ID,) to cancel it, and None to stop. It sends
+    back (job ID, (succeeded, result or exception, requests)) for each job
+    which isn't cancelled (see _run_job)"""
+    global _session
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    _session = loop.run_until_complete(_create_session())
+    tasks = {}
+
+    def finish(job_id: int, task: asyncio.Task):
+        del tasks[job_id]
+        if not task.cancelled():
+            results_connection.send((job_id, task.result()))
+
+    def handle(message):
+        if message is None:
+            loop.stop()
+        elif len(message) == 1:
+            if message[0] in tasks:
+                tasks[message[0]].cancel()
+        else:
+            job_id, function, args = message
+            tasks[job_id] = loop.create_task(_run_job(function, args))
+            tasks[job_id].add_done_callback(
+                lambda task: finish(job_id, task))
+
+    def receive():
+        while True:
+            try:
+                message = jobs_connection.recv()
+            except (EOFError, OSError):
+                message = None
+            loop.call_soon_threadsafe(handle, message)
+            if message is None:
+                return
+
+    threading.Thread(target=receive, name="jobs", daemon=True).start()
+    loop.run_forever()
+    for task in tasks.values():
+        task.cancel()
+    loop.run_until_complete(_session.close())
+
+
+async def execute(wandbox_url: str, request: dict):
+    """Executes a request on wandbox, returns its result"""
+    with measure("wandbox", "compile.json") as upstream_request:
+        async with async_timeout.timeout(15):
+            async with _session.post(
+                    wandbox_url + "compile.json",
+                    data=json.dumps(request),
+                    headers={"content-type": "text/javascript"}) as response:
+                upstream_request["status"] = response.status
+                return await response.json()
+
+
+async def render(job: dict):
+    """Renders the result of a run (see Code.create_render_job), returns the
+    content and the embed (as a dict) of its message"""
+
+    async def upload(paste_name: str, paste_code: str):
+        with measure("pastebin", "create") as upstream_request:
+            upstream_request["status"], url = await rendering.create_pastebin(
+                _session, job["pastebin_url"], job["pastebin_api_key"],
+                paste_name, paste_code)
+            return url
+
+    content, embed = await rendering.render_run_result(job, upload)
+    return content, embed.to_dict() if embed else None
+
+
+class WorkerPool:
+    """Worker processes, each one with its own event loop and HTTP session.
+    A job is sent to the worker with the fewest jobs in progress"""
+
+    def __init__(self, processes: int = None, loop=None):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.loop = loop or asyncio.get_event_loop()
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = []
+        self.job_ids = itertools.count()
+        self.closed = False
+
+    def start(self):
+        """Starts the missing workers"""
+        while len(self.workers) < self.processes:
+            self.start_worker()
+
+    def start_worker(self):
+        """Starts a worker process, and the thread receiving its results"""
+        jobs_receiver, jobs_sender = self.context.Pipe(duplex=False)
+        results_receiver, results_sender = self.context.Pipe(duplex=False)
+        worker = {
+            "process":
+                self.context.Process(target=_work,
+                                     args=(jobs_receiver, results_sender),
+                                     daemon=True),
+            "connection": jobs_sender,
+            # Writes to the connection, as the jobs may be big
+            "sender": ThreadPoolExecutor(1),
+            # Futures of the jobs in progress, by job ID
+            "jobs": {}
+        }
+        worker["process"].start()
+        # The ends used by the worker
+        jobs_receiver.close()
+        results_sender.close()
+        threading.Thread(target=self.receive,
+                         args=(worker, results_receiver),
+                         name="worker results",
+                         daemon=True).start()
+        self.workers.append(worker)
+
+    def receive(self, worker: dict, connection):
+        try:
+            while True:
+                try:
+                    job_id, result = connection.recv()
+                except (EOFError, OSError):
+                    break
+                self.loop.call_soon_threadsafe(self.resolve, worker, job_id,
+                                               result)
+            if not self.closed:
+                self.loop.call_soon_threadsafe(self.replace_worker, worker)
+        except RuntimeError:
+            # The loop is closed, the bot is exiting
+            pass
+
+    def resolve(self, worker: dict, job_id: int, result: tuple):
+        future = worker["jobs"].pop(job_id, None)
+        if future and not future.done():
+            future.set_result(result)
+
+    def send(self, worker: dict, message):
+        """Sends a message to a worker without waiting for it"""
+        try:
+            worker["sender"].submit(worker["connection"].send, message)
+        except RuntimeError:
+            # The worker has been stopped
+            pass
+
+    def replace_worker(self, worker: dict):
+        """Fails the jobs of a worker which exited, and starts another one"""
+        if worker not in self.workers:
+            return
+        self.workers.remove(worker)
+        for future in worker["jobs"].values():
+            if not future.done():
+                future.set_exception(RuntimeError("The worker exited"))
+        worker["sender"].shutdown(wait=False)
+        worker["connection"].close()
+        if not self.closed:
+            self.start_worker()
+
+    async def run(self, function, *args, record=None):
+        """Runs a coroutine function of this module in a worker. Cancelling
+        it cancels the job in the worker. `record` is called with the time
+        the job was sent (time.perf_counter()) and its requests to wandbox /
+        pastebin (see _run_job)"""
+        self.start()
+        worker = min(self.workers, key=lambda worker: len(worker["jobs"]))
+        job_id = next(self.job_ids)
+        future = self.loop.create_future()
+        worker["jobs"][job_id] = future
+        begin = time.perf_counter()
+        try:
+            await self.loop.run_in_executor(worker["sender"],
+                                            worker["connection"].send,
+                                            (job_id, function, args))
+            succeeded, value, requests = await future
+        except asyncio.CancelledError:
+            if worker["jobs"].pop(job_id, None):
+                self.send(worker, (job_id,))
+            raise
+        finally:
+            worker["jobs"].pop(job_id, None)
+        if record:
+            record(begin, requests)
+        if not succeeded:
+            raise value
+        return value
+
+    def close(self):
+        self.closed = True
+        for worker in self.workers:
+            self.send(worker, None)
+            worker["sender"].shutdown(wait=False)
+        self.workers = []